@@ -39,7 +39,11 @@ attribute access.
 
 from __future__ import absolute_import
 from datagrok.misc.flatten import flatten
+from datagrok.misc.templates import parse_format
+import collections
+import contextlib
 import sys
+import threading
 
 #__all__ = ['FormatStringDict', 'LazyDict', 'LazyFormatStringDict']
 
@@ -59,7 +63,69 @@ import sys
 # custom 'collections' module.
 
 
-class FormatStringDict(dict):
+class RenderCache(object):
+    """The values evaluated during a render scope (see RenderScopeMixin),
+    with counts of the evaluations it saved ('hits') and performed
+    ('misses') over the scope's lifetime.
+
+    """
+    def __init__(self):
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        """Forget the cached values, as between one render and the next.
+        The counts are kept.
+
+        """
+        self.values.clear()
+
+
+# The RenderCache of each render scope open in this thread, by the id() of the
+# dict it belongs to.
+_render_scopes = threading.local()
+
+
+class RenderScopeMixin(object):
+    """Within a render_scope(), each callable or generator value is
+    evaluated at most once, and reused until the scope's cache is cleared.
+
+    Outside of a render scope, values are evaluated every time they are
+    accessed, as usual. Render scopes belong to the thread that opens them,
+    so threads sharing a dict may each render it in a scope of their own.
+
+    """
+
+    @contextlib.contextmanager
+    def render_scope(self):
+        """Memoize evaluated values while the block runs, yielding the
+        RenderCache. Call its clear() between renders to re-evaluate.
+
+        """
+        try:
+            caches = _render_scopes.caches
+        except AttributeError:
+            caches = _render_scopes.caches = {}
+        if id(self) in caches:
+            raise RuntimeError('Render scopes may not be nested')
+        cache = caches[id(self)] = RenderCache()
+        try:
+            yield cache
+        finally:
+            del caches[id(self)]
+
+    def _render_cache(self):
+        """Return the RenderCache of this thread's render scope, or None."""
+        caches = getattr(_render_scopes, 'caches', None)
+        return caches.get(id(self)) if caches else None
+
+    @staticmethod
+    def _is_lazy(item):
+        return callable(item) or isinstance(item, collections.Iterator)
+
+
+class FormatStringDict(RenderScopeMixin, dict):
     """This is a dictionary whose values are strings only, by calling callable
     values and flattening iterable values. It's good for sloppy string
     replacement with lazy evaluation. Does not generate keyerrors, instead
@@ -69,12 +135,100 @@ class FormatStringDict(dict):
     "%(key)s" as a default a "closure dict," because it enables "partial
     interpolation" of a format string.
 
+    Within a render_scope(), lazy values are evaluated once:
+
+        >>> calls = []
+        >>> x = FormatStringDict({'user': lambda: calls.append(1) or 'bob'})
+        >>> with x.render_scope() as cache:
+        ...     print '%(user)s %(user)s %(user)s' % x
+        ...     cache.clear()
+        ...     print '%(user)s' % x
+        bob bob bob
+        bob
+        >>> len(calls), cache.hits, cache.misses
+        (2, 2, 2)
+
     """
     def __init__(self, initial={}):
         dict.__init__(self, initial)
     def __getitem__(self, key):
+        return ''.join(self._pieces(key))
+
+    def _pieces(self, key):
+        """Generate the strings making up the value of 'key', as they are
+        produced.
+
+        """
         item = super(FormatStringDict, self).get(key, '%('+key+')s')
-        return ''.join([str(x) for x in flatten(item)])
+        cache = self._render_cache()
+        if cache is None or not self._is_lazy(item):
+            for x in flatten(item):
+                yield str(x)
+            return
+        try:
+            pieces = cache.values[key]
+        except KeyError:
+            pieces = []
+            for x in flatten(item):
+                pieces.append(str(x))
+                yield pieces[-1]
+            cache.values[key] = pieces
+            cache.misses += 1
+        else:
+            cache.hits += 1
+            for piece in pieces:
+                yield piece
+
+    def iter_format(self, template):
+        """Generate the pieces of the format string 'template' interpolated
+        with this dict, as the lazy values produce them. No value with a
+        plain '%(key)s' conversion is ever joined into a single string.
+
+            >>> x = FormatStringDict({'title': 'Hi', 'body': lambda:
+            ...     ('<p>%d</p>' % i for i in range(3))})
+            >>> list(x.iter_format('<h1>%(title)s</h1>%(body)s%(foot)s'))
+            ['<h1>', 'Hi', '</h1>', '<p>0</p>', '<p>1</p>', '<p>2</p>', '%(foot)s']
+
+        Every conversion must have a mapping key. Conversions other than '%s'
+        (with a width, for example) need the whole value, so they are
+        formatted as usual.
+
+        """
+        literals, fields = parse_format(template)
+        for literal, (key, conversion) in zip(literals, fields):
+            if literal:
+                yield literal
+            if conversion == '%s':
+                for piece in self._pieces(key):
+                    yield piece
+            else:
+                yield conversion % self[key]
+        if literals[-1]:
+            yield literals[-1]
+
+    def write_format(self, template, out, chunk_size=65536):
+        """Write the format string 'template' interpolated with this dict to
+        the file-like 'out' (for a socket, use its makefile()), gathering the
+        pieces into writes of about 'chunk_size' characters. Memory use is
+        bounded by 'chunk_size' and by the largest single piece produced.
+
+            >>> import sys
+            >>> x = FormatStringDict({'title': lambda: 'Hi'})
+            >>> x.write_format('%(title)s, %(title)s!\\n', sys.stdout)
+            Hi, Hi!
+
+        """
+        chunk = []
+        size = 0
+        for piece in self.iter_format(template):
+            chunk.append(piece)
+            size += len(piece)
+            if size >= chunk_size:
+                out.write(''.join(chunk))
+                chunk = []
+                size = 0
+        if chunk:
+            out.write(''.join(chunk))
 
 
 class AttDict(dict):
@@ -99,13 +253,50 @@ class FormatStringAttDict(AttDict):
         return ''.join([str(x) for x in flatten(item)])
 
 
-class LazyDict(dict):
+class LazyDict(RenderScopeMixin, dict):
     """Another attribute-access dictionary based on Storage, from web.py
 
     A LazyDict object is like a dictionary except that `obj.foo` can be used in
     addition to `obj['foo']` to access its values.
+
+    Within a render_scope(), callable values are called and generator values
+    are gathered into a list, once, and the result is given for every access
+    until the scope's cache is cleared.
+
+        >>> d = LazyDict(rows=lambda: [1, 2], name='x')
+        >>> with d.render_scope() as cache:
+        ...     d.rows, d['rows'], d.name
+        ([1, 2], [1, 2], 'x')
+        >>> cache.hits, cache.misses, callable(d.rows)
+        (1, 1, True)
+
+    Another thread does not share the scope:
+
+        >>> import threading
+        >>> seen = []
+        >>> with d.render_scope():
+        ...     t = threading.Thread(target=lambda: seen.append(d.rows))
+        ...     t.start(); t.join()
+        ...     d.rows
+        [1, 2]
+        >>> callable(seen[0])
+        True
     
     """
+    def __getitem__(self, key):
+        item = dict.__getitem__(self, key)
+        cache = self._render_cache()
+        if cache is None or not self._is_lazy(item):
+            return item
+        try:
+            value = cache.values[key]
+        except KeyError:
+            value = item() if callable(item) else list(item)
+            cache.values[key] = value
+            cache.misses += 1
+        else:
+            cache.hits += 1
+        return value
     def __getattr__(self, key):
         if self.has_key(key):
             return self[key]
@@ -123,3 +314,33 @@ class AttAccessMapping(object):
     # TODO: move this into a module named 'collections', make it work with
     # py2.6 collections.
     pass
+
+
+def _benchmark():
+    """Compare peak memory use interpolating a 50MB generated body by
+    streaming, and by % formatting.
+
+    """
+    import os
+    import resource
+    import timeit
+
+    def body():
+        for i in xrange(500000):
+            yield '<p>%-90d</p>\n' % i
+
+    x = FormatStringDict({'title': 'Big', 'body': body})
+    template = '<html><h1>%(title)s</h1>%(body)s</html>'
+    with open(os.devnull, 'w') as out:
+        for label, run in [
+                ('write_format()', lambda: x.write_format(template, out)),
+                ('%', lambda: out.write(template % x))]:
+            start = timeit.default_timer()
+            run()
+            elapsed = timeit.default_timer() - start
+            print '%-15s %.2f sec, peak RSS %d MB' % (label, elapsed,
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024)
+
+
+if __name__ == "__main__":
+    _benchmark()
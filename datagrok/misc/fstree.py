@@ -1,7 +1,8 @@
 """Manages a unix-filesystem-like heiarchy of objects.
 
 Backed by a string-keyed dict, so you may persist using anydbm (if using string
-values) or shelve (for object values).
+values) or shelve (for object values). For large trees, SQLiteFSTree keeps the
+paths indexed on disk and loads values only as they are requested.
 
     >>> x = FSTree()
 
@@ -30,14 +31,24 @@ Parent nodes are implicitly instantiated to None:
     })
     >>> list(x.children(''))
     ['a']
-    >>> list(x.children('a/b'))
-    ['a/b/b', 'a/b/c', 'a/b/a']
+    >>> sorted(x.children('a/b'))
+    ['a/b/a', 'a/b/b', 'a/b/c']
+    >>> sorted(x.siblings('a/b/c'))
+    ['a/b/a', 'a/b/b', 'a/b/c']
     >>> list(x.children('a/b/c'))
     []
 
-Deleting a node recursively deletes its children:
+Descendants are enumerated in sorted order:
+
+    >>> x['ab'] = "sibling"
+    >>> list(x.descendants('a'))
+    ['a/b', 'a/b/a', 'a/b/b', 'a/b/c']
+
+Deleting a node recursively deletes its children, but not siblings that
+merely share a prefix:
 
     >>> del x['a/b']
+    >>> del x['ab']
     >>> x
     FSTree({
         '':                  None,
@@ -60,12 +71,29 @@ Leading, trailing, and gratuitous inner separators are normalized:
     True
     >>> x['a'] == x['/a/']
     True
+
+Normalized string paths are remembered in the path_cache() of the class,
+which counts the lookups that it saved:
+
+    >>> from datagrok.misc.tree import path_cache
+    >>> cache = path_cache(FSTree)
+    >>> hits, misses = cache.hits, cache.misses
+    >>> x['/a/'] == x['a//']
+    True
+    >>> cache.hits - hits, cache.misses - misses
+    (1, 1)
+
     >>> print x.repr_tree()
     FSTree:
         '':                  None
         'a':                 'blah'
 
 """
+import cPickle as pickle
+import sqlite3
+from fnmatch import fnmatchcase
+from glob import has_magic
+from datagrok.misc.tree import remember_path
 
 class FSTree(object):
 
@@ -74,8 +102,24 @@ class FSTree(object):
             self.tree = tree
         else:
             self.tree = dict()
+        # Maps each path to the set of paths of its immediate children, so
+        # that children() need not scan the entire tree.
+        self._children = dict()
+        for path in self.tree:
+            self._index_add(path)
 
     def norm_path(self, path):
+        if type(path) is str:
+            cache = type(self).__dict__.get('_path_cache')
+            if cache is not None:
+                normed = cache.get(path)
+                if normed is not None:
+                    cache.hits += 1
+                    return normed
+            return remember_path(type(self), path, self._norm_path(path))
+        return self._norm_path(path)
+
+    def _norm_path(self, path):
         if not isinstance(path, str):
             if not all(isinstance(x, str) for x in path):
                 raise TypeError('Got path %s, expected <type \'str\'>' % type(path))
@@ -87,6 +131,34 @@ class FSTree(object):
             raise ValueError('No support for special path component %s' % repr(s))
         return s
 
+    def _index_add(self, path):
+        """Record an already-normalized path in the children index."""
+        if path:
+            parent = path.rpartition('/')[0]
+            self._children.setdefault(parent, set()).add(path)
+
+    def _index_discard(self, path):
+        """Remove an already-normalized path from the children index."""
+        self._children.pop(path, None)
+        if path:
+            siblings = self._children.get(path.rpartition('/')[0])
+            if siblings is not None:
+                siblings.discard(path)
+
+    def _descendants(self, path):
+        """Return a list of the descendants of an already-normalized path,
+        not including itself, by walking the children index.
+
+        """
+        found = []
+        stack = [path]
+        while stack:
+            children = self._children.get(stack.pop())
+            if children:
+                found.extend(children)
+                stack.extend(children)
+        return found
+
     def __getitem__(self, path):
         path = self.norm_path(path)
         return self.tree[path]
@@ -96,13 +168,17 @@ class FSTree(object):
         for par in self.parents(path):
             if par not in self.tree:
                 self.tree[par] = None
+                self._index_add(par)
         self.tree[path] = node
 
     def __delitem__(self, path):
         path = self.norm_path(path)
-        for p in self.tree.keys():
-            if p.startswith(path):
-                del self.tree[p]
+        for p in self._descendants(path):
+            del self.tree[p]
+            self._children.pop(p, None)
+        if path in self.tree:
+            del self.tree[path]
+            self._index_discard(path)
 
     def __contains__(self, path):
         path = self.norm_path(path)
@@ -111,16 +187,20 @@ class FSTree(object):
     def __iter__(self):
         return iter(self.tree)
 
-    def repr_keylist(self):
+    def _sorted_items(self):
+        """Return all (path, value) pairs, sorted by path component."""
         ks = self.tree.items()
         ks.sort(key=lambda x: x[0].split('/'))
+        return ks
+
+    def repr_keylist(self):
+        ks = self._sorted_items()
         if not ks:
             return self.__class__.__name__ + '({})'
         return self.__class__.__name__ + '({\n' + '\n'.join(["    %-20s %s," % (repr(path)+':', repr(page)) for path, page in ks]) + '\n})'
 
     def repr_tree(self):
-        ks = self.tree.items()
-        ks.sort(key=lambda x: x[0].split('/'))
+        ks = self._sorted_items()
         if not ks:
             return self.__class__.__name__ + '({})'
         def pathrepr(path):
@@ -134,23 +214,28 @@ class FSTree(object):
     def children(self, path):
         """Return an iterable of paths of children of the specified path.
 
-        This is currently NOT efficient, order of O(n), scanning the entire
-        tree on each call.
-        
+        Children are read from an index maintained by __setitem__ and
+        __delitem__, so this is O(k) in the number of children rather than in
+        the size of the tree. The tree may be modified while iterating.
+
         """
         path = self.norm_path(path)
-        #XXX FIXME not efficient
-        valid_child = lambda x: x.startswith(path) \
-                and x != path \
-                and '/' not in x[len(path)+1:]
-        #return (k for k in self.tree if valid_child(k)) # Py 2.5
-        for k in self.tree:
-            if valid_child(k):
-                yield k
+        return list(self._children.get(path, ()))
+
+    def descendants(self, path):
+        """Return an iterable of paths of all descendants of the specified
+        path, in sorted order.
+
+        This walks the children index, so it is O(k log k) in the number of
+        descendants rather than depending on the size of the tree.
+
+        """
+        path = self.norm_path(path)
+        return sorted(self._descendants(path))
 
     def children_items(self, path):
         """Return an iterable of children (path, value) of the specified path.
-        O(n).
+        O(k) in the number of children.
 
         """
         for c in self.children(path):
@@ -188,6 +273,292 @@ class FSTree(object):
     def siblings(self, path):
         return self.children(self.parent(path))
 
+    def longest_prefix(self, path):
+        """Return (prefix, suffix): the deepest existing path that is a
+        prefix of 'path', and the remainder of 'path' beyond it.
+
+            >>> x = FSTree()
+            >>> x['blog/2016'] = 'archive'
+            >>> x.longest_prefix('/blog/2016/03/hello')
+            ('blog/2016', '03/hello')
+
+        """
+        path = self.norm_path(path)
+        prefix = ''
+        for p in self.parents(path):
+            if p and p not in self:
+                break
+            prefix = p
+        return prefix, path[len(prefix):].lstrip('/')
+
+    def glob(self, pattern):
+        """Generate the paths matching 'pattern', whose components may
+        contain the shell-style wildcards of the fnmatch module; each matches
+        a single path component. Only wildcard components cost a scan, of the
+        children at their level.
+
+            >>> x = FSTree()
+            >>> x['blog/a/comments'] = 1
+            >>> x['blog/b/comments'] = 2
+            >>> x['blog/b/edit'] = 3
+            >>> sorted(x.glob('/blog/*/comments'))
+            ['blog/a/comments', 'blog/b/comments']
+
+        """
+        pattern = self.norm_path(pattern)
+        level = ['']
+        for component in pattern.split('/') if pattern else []:
+            if has_magic(component):
+                level = [child for path in level
+                         for child in self.children(path)
+                         if fnmatchcase(child.rpartition('/')[2], component)]
+            else:
+                level = [p for p in (
+                    (path + '/' + component) if path else component
+                    for path in level) if p in self]
+        return iter(level)
+
+
+class SQLiteFSTree(FSTree):
+    """An FSTree persisted in an SQLite database.
+
+    Opening the database reads nothing but its schema: lookups, children() and
+    parents_items() are answered by indexed queries, and values are unpickled
+    only when they are requested. Each modification is committed immediately.
+
+        >>> x = SQLiteFSTree(':memory:')
+        >>> x['a/b/a'] = "one"
+        >>> x['a/b/b'] = {'two': 2}
+        >>> x['a/b/b']
+        {'two': 2}
+        >>> list(x.children('a/b'))
+        ['a/b/a', 'a/b/b']
+        >>> list(x.parents_items('a/b/a'))
+        [('', None), ('a', None), ('a/b', None), ('a/b/a', 'one')]
+
+    load() streams (path, value) pairs in a single transaction. When the pairs
+    arrive in sorted order, parents that were already created are not
+    revisited.
+
+        >>> x.load([('ab', 1), ('ab/c', 2), ('ab/d/e', 3)])
+        >>> list(x.descendants('ab'))
+        ['ab/c', 'ab/d', 'ab/d/e']
+        >>> del x['a']
+        >>> list(x)
+        ['', 'ab', 'ab/c', 'ab/d', 'ab/d/e']
+        >>> print x.repr_tree()
+        SQLiteFSTree:
+            '':                  None
+            'ab':                1
+              'c':               2
+              'd':               None
+                'e':             3
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.text_factory = str
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS fstree '
+                    '(path TEXT PRIMARY KEY, parent TEXT, value BLOB)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS fstree_parent '
+                    'ON fstree (parent)')
+
+    def close(self):
+        self.db.close()
+
+    def _dumps(self, value):
+        if value is None:
+            return None
+        return sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def _loads(self, data):
+        if data is None:
+            return None
+        return pickle.loads(str(data))
+
+    def _insert_parents(self, path):
+        """Create any missing ancestors of an already-normalized path."""
+        parent = None
+        for par in self.parents(path):
+            if par == path:
+                break
+            self.db.execute('INSERT OR IGNORE INTO fstree VALUES (?, ?, NULL)',
+                    (par, parent))
+            parent = par
+        return parent
+
+    def __getitem__(self, path):
+        path = self.norm_path(path)
+        row = self.db.execute('SELECT value FROM fstree WHERE path = ?',
+                (path,)).fetchone()
+        if row is None:
+            raise KeyError(path)
+        return self._loads(row[0])
+
+    def __setitem__(self, path, node):
+        path = self.norm_path(path)
+        with self.db:
+            parent = self._insert_parents(path)
+            self.db.execute('INSERT OR REPLACE INTO fstree VALUES (?, ?, ?)',
+                    (path, parent, self._dumps(node)))
+
+    def __delitem__(self, path):
+        path = self.norm_path(path)
+        with self.db:
+            if not path:
+                self.db.execute('DELETE FROM fstree')
+            else:
+                self.db.execute('DELETE FROM fstree WHERE path = ? '
+                        'OR (path >= ? AND path < ?)',
+                        (path, path + '/', path + '0'))
+
+    def __contains__(self, path):
+        path = self.norm_path(path)
+        return self.db.execute('SELECT 1 FROM fstree WHERE path = ?',
+                (path,)).fetchone() is not None
+
+    def __iter__(self):
+        for row in self.db.execute('SELECT path FROM fstree ORDER BY path'):
+            yield row[0]
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.filename)
+
+    def _sorted_items(self):
+        ks = [(row[0], self._loads(row[1])) for row in
+              self.db.execute('SELECT path, value FROM fstree')]
+        ks.sort(key=lambda x: x[0].split('/'))
+        return ks
+
+    def load(self, items):
+        """Insert an iterable of (path, value) pairs, creating parents as
+        needed, in a single transaction.
+
+        """
+        ancestors = set()
+        with self.db:
+            for path, node in items:
+                path = self.norm_path(path)
+                parent = path.rpartition('/')[0] if path else None
+                if parent is not None and parent not in ancestors:
+                    self._insert_parents(path)
+                    ancestors = set(self.parents(parent))
+                self.db.execute('INSERT OR REPLACE INTO fstree VALUES (?, ?, ?)',
+                        (path, parent, self._dumps(node)))
+
+    def children(self, path):
+        """Return an iterable of paths of children of the specified path."""
+        path = self.norm_path(path)
+        return [row[0] for row in self.db.execute(
+                'SELECT path FROM fstree WHERE parent = ? ORDER BY path',
+                (path,))]
+
+    def children_items(self, path):
+        """Return an iterable of children (path, value) of the specified path."""
+        path = self.norm_path(path)
+        for row in self.db.execute('SELECT path, value FROM fstree '
+                'WHERE parent = ? ORDER BY path', (path,)):
+            yield (row[0], self._loads(row[1]))
+
+    def descendants(self, path):
+        """Return an iterable of paths of all descendants of the specified
+        path, in sorted order.
+
+        """
+        path = self.norm_path(path)
+        if not path:
+            query, args = 'path > ?', ('',)
+        else:
+            query, args = 'path >= ? AND path < ?', (path + '/', path + '0')
+        return [row[0] for row in self.db.execute(
+                'SELECT path FROM fstree WHERE ' + query + ' ORDER BY path',
+                args)]
+
+    def parents_items(self, path):
+        """Return an iterable of parents (path, value) of the specified path.
+
+        All values are fetched with a single query.
+
+        """
+        parents = list(self.parents(path))
+        values = dict((row[0], row[1]) for row in self.db.execute(
+                'SELECT path, value FROM fstree WHERE path IN (%s)' %
+                ', '.join('?' * len(parents)), parents))
+        for p in parents:
+            yield (p, self._loads(values.get(p)))
+
+
+def _benchmark():
+    """Show that children() lookups and subtree deletes cost the same
+    regardless of tree size.
+
+    """
+    import timeit
+    t = FSTree()
+    path = '/content/section42/page4242/'
+    t.norm_path(path)
+    for label, norm_path in [('cached', t.norm_path),
+                             ('uncached', t._norm_path)]:
+        timer = timeit.Timer(lambda: norm_path(path))
+        best = min(timer.repeat(repeat=3, number=100000)) / 100000
+        print 'norm_path() %-8s %.2f usec' % (label, best * 1e6)
+
+    for size in (1000, 10000, 100000, 400000):
+        t = FSTree()
+        start = timeit.default_timer()
+        for i in range(20):
+            t['nav/item%d' % i] = i
+        for i in range(size):
+            t['content/section%d/page%d' % (i % 100, i)] = i
+        elapsed = timeit.default_timer() - start
+        timer = timeit.Timer(lambda: list(t.children('nav')))
+        best = min(timer.repeat(repeat=3, number=10000)) / 10000
+        print '%8d paths: insert %.1f usec/path, children() %.2f usec' % (
+                len(t.tree), elapsed / len(t.tree) * 1e6, best * 1e6)
+
+    for size in (1000, 10000, 100000, 400000):
+        t = FSTree()
+        for i in range(size):
+            t['content/section%d/page%d' % (i % 100, i)] = i
+        for i in range(1000):
+            t['doomed/page%d' % i] = i
+        start = timeit.default_timer()
+        del t['doomed']
+        elapsed = timeit.default_timer() - start
+        print '%8d paths: delete 1000-path subtree %.2f msec' % (
+                len(t.tree), elapsed * 1e3)
+
+    import os
+    import tempfile
+    fd, filename = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    try:
+        size = 400000
+        t = SQLiteFSTree(filename)
+        start = timeit.default_timer()
+        t.load(('content/section%03d/page%06d' % (i // 4000, i), 'x' * 100)
+                for i in xrange(size))
+        elapsed = timeit.default_timer() - start
+        t.close()
+        print '%8d paths: SQLiteFSTree load() %.0f paths/sec' % (
+                size, size / elapsed)
+        start = timeit.default_timer()
+        t = SQLiteFSTree(filename)
+        t['content/section042/page168042']
+        elapsed = timeit.default_timer() - start
+        print '%8d paths: SQLiteFSTree open and first lookup %.2f msec' % (
+                size, elapsed * 1e3)
+        t.close()
+    finally:
+        os.remove(filename)
+
+
+if __name__ == "__main__":
+    _benchmark()
+
 
 #if __name__ == "__main__":
     #import shelve
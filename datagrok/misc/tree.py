@@ -140,6 +140,10 @@ semantics are same as dict keys: any immutable object is fine.
 """
 from __future__ import absolute_import
 import collections
+import sys
+import threading
+from fnmatch import fnmatchcase
+from glob import has_magic
 
 # Design defenses:
 #
@@ -148,6 +152,79 @@ import collections
 # just any sequence, like tuples, because immutable sequences are themselves
 # valid path elements.
 
+class WalkPath(collections.Sequence):
+    """The path of a node generated by HierarchicalMapping.walk(): the
+    node's key, linked to the WalkPath of its parent. A path shares its
+    parent's rather than copying it, so a walk creates one small object per
+    node at any depth, and a path stays valid after the walk moves on.
+
+    A WalkPath is an immutable sequence of keys. Its length and last key are
+    found in O(1), other keys in O(depth). It compares equal to a list or
+    tuple of the same keys.
+
+        >>> p = WalkPath.from_keys(['a', 'b']).child('c')
+        >>> len(p), p[-1], p[0], list(p), p == ['a', 'b', 'c']
+        (3, 'c', 'a', ['a', 'b', 'c'], True)
+        >>> p.parent
+        WalkPath.from_keys(('a', 'b'))
+
+    """
+    __slots__ = ('parent', 'key', 'depth')
+
+    def __init__(self, parent=None, key=None):
+        self.parent = parent
+        self.key = key
+        self.depth = 0 if parent is None else parent.depth + 1
+
+    @classmethod
+    def from_keys(cls, keys):
+        """Return the WalkPath of the sequence 'keys'."""
+        path = cls()
+        for key in keys:
+            path = cls(path, key)
+        return path
+
+    def child(self, key):
+        return self.__class__(self, key)
+
+    def __len__(self):
+        return self.depth
+
+    def __iter__(self):
+        keys = list(reversed(self))
+        keys.reverse()
+        return iter(keys)
+
+    def __reversed__(self):
+        path = self
+        while path.parent is not None:
+            yield path.key
+            path = path.parent
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self)[index]
+        if index < 0:
+            index += self.depth
+        if not 0 <= index < self.depth:
+            raise IndexError('WalkPath index out of range')
+        path = self
+        for i in xrange(self.depth - 1 - index):
+            path = path.parent
+        return path.key
+
+    def __cmp__(self, other):
+        if not isinstance(other, (WalkPath, list, tuple)):
+            return NotImplemented
+        return cmp(tuple(self), tuple(other))
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return 'WalkPath.from_keys(%r)' % (tuple(self),)
+
+
 class HierarchicalMapping(collections.MutableMapping):
     """The base class for all hierarchical containers. Users may expect these
     methods to exist; varying implementations should subclass this class.
@@ -210,33 +287,98 @@ class HierarchicalMapping(collections.MutableMapping):
         """
         raise NotImplementedError()
 
-    def descendants(self, path):
-        """Generate a sequence of paths to every descendent of 'path'.
+    def descendants(self, path=[]):
+        """Generate a sequence of paths to every descendent of 'path', in
+        depth-first order. Each path is a WalkPath, as generated by walk(),
+        so none is copied; it compares equal to the list of its keys, and
+        list() converts it, at O(depth) per path.
 
         This function requires 'path' to exist in the structure.
 
         """
-        raise NotImplementedError()
+        walk = self.walk(path, depth=True)
+        next(walk)
+        for node, p in walk:
+            yield p
 
     def walk(self, path=[], callback=None, depth=False):
         """Walk the nodes in a HierarchicalMapping in breadth-first-search
-        order. 
+        order, or depth-first (pre-order) if 'depth' is true, generating
+        (node, path) pairs.
 
         This is like os.walk() in that your callback can modify its arguments
         to control the walking and pruning of branches. If you just want to do
         something on every leaf, .descendants() might be what you want instead. 
 
-        """
-        raise NotImplementedError()
-
-        # XXX TODO FIXME
-        if not isinstance(tree, HierarchicalMapping):
-            raise RuntimeWarning("%s expects HierarchicalMapping, not %s." % (__name__, tree.__class__))
-        yield (tree, path)
-        for path_component, node in tree.children.items():
-            for t, p in walk(node, path + [path_component]):
-                yield (t, p)
+        The callback is called as callback(node, path, keys) before each node
+        is generated; removing entries from the list 'keys' prevents the walk
+        from descending into those children.
+
+        The walk uses an explicit stack (or queue), never recursion, so any
+        depth of tree may be walked. In either order, each path is generated
+        as a WalkPath, an immutable sequence of keys linked to its parent's
+        path, so no path is copied and every path may be kept.
+
+            >>> T = Tree()
+            >>> for p in ['a', 'a/b', 'a/b/c', 'a/d', 'e']:
+            ...     T[p] = p
+            >>> def prune_d(node, path, keys):
+            ...     if 'd' in keys: keys.remove('d')
+            >>> sorted(list(p) for n, p in T.walk(callback=prune_d))
+            [[], ['a'], ['a', 'b'], ['a', 'b', 'c'], ['e']]
+            >>> [tuple(p) for n, p in T.walk('a')]
+            [('a',), ('a', 'b'), ('a', 'd'), ('a', 'b', 'c')]
+            >>> paths = [p for n, p in T.walk('a', depth=True)]
+            >>> sorted(paths) == [['a'], ['a', 'b'], ['a', 'b', 'c'], ['a', 'd']]
+            True
+            >>> sorted(list(p) for p in T.descendants('a'))
+            [['a', 'b'], ['a', 'b', 'c'], ['a', 'd']]
+
+        This implementation relies upon node() and the 'children' mapping of
+        the nodes it returns; subclasses structured differently must override
+        it.
 
+        """
+        keys = list(self.norm_path(path))
+        path = WalkPath.from_keys(keys)
+        node = self.node(keys)
+        if depth:
+            return self._walk_depth_first(node, path, callback)
+        return self._walk_breadth_first(node, path, callback)
+
+    @staticmethod
+    def _walk_depth_first(node, path, callback):
+        keys = list(node.children)
+        if callback is not None:
+            callback(node, path, keys)
+        yield node, path
+        stack = [(node, path, iter(keys))]
+        while stack:
+            parent, parent_path, keys = stack[-1]
+            for key in keys:
+                node = parent.children[key]
+                path = WalkPath(parent_path, key)
+                child_keys = list(node.children)
+                if callback is not None:
+                    callback(node, path, child_keys)
+                yield node, path
+                stack.append((node, path, iter(child_keys)))
+                break
+            else:
+                stack.pop()
+
+    @staticmethod
+    def _walk_breadth_first(node, path, callback):
+        queue = collections.deque([(node, path)])
+        while queue:
+            node, path = queue.popleft()
+            keys = list(node.children)
+            if callback is not None:
+                callback(node, path, keys)
+            yield node, path
+            children = node.children
+            for key in keys:
+                queue.append((children[key], WalkPath(path, key)))
 
 
 class SimpleNestedDictTree(dict):
@@ -276,11 +418,33 @@ class GeneralTreeNode(HierarchicalMapping):
         self.value = None
 
     def node(self, path):
+        """Return the node at 'path', a list of path components.
+
+        The path is walked iteratively and is neither copied nor modified, so
+        arbitrarily deep paths are fine:
+
+            >>> T = GeneralTreeNode()
+            >>> path = []
+            >>> for i in range(2000):
+            ...     path.append(i)
+            ...     T[path] = i
+            >>> T.node(path).value, len(path)
+            (1999, 2000)
+
+        """
         if not isinstance(path, list):
             raise AttributeError("Not a list of path components: %s" % path)
-        if len(path) == 0:
-            return self
-        return self.children[path.pop(0)].node(path)
+        node = self
+        for key in path:
+            node = node.children[key]
+        return node
+
+    def _parent_node(self, path):
+        """Return the node that is the parent of the non-empty 'path'."""
+        node = self
+        for i in xrange(len(path) - 1):
+            node = node.children[path[i]]
+        return node
 
     def norm_path(self, path):
         if not isinstance(path, list):
@@ -296,40 +460,254 @@ class GeneralTreeNode(HierarchicalMapping):
         if len(path) == 0:
             self.value = value
             return
-        parent = self.node(path[:-1])
-        if path[-1] not in parent.children:
-            parent.children[path[-1]] = self.__class__()
-        parent.children[path[-1]].value = value
+        self._parent_node(path).add_child(path[-1]).value = value
+
+    @classmethod
+    def bulk_load(cls, items):
+        """Return a new tree populated from an iterable of (path, value)
+        pairs. See update_many().
+
+        """
+        tree = cls()
+        tree.update_many(items)
+        return tree
+
+    def update_many(self, items):
+        """Set the value of each path in an iterable of (path, value) pairs,
+        creating any missing parents with the value None.
+
+        The nodes resolved for each path are remembered, and the next path
+        descends only from the deepest node it has in common with the
+        previous one. So, while pairs may arrive in any order, sorted pairs
+        are loaded fastest.
+
+            >>> T = Tree.bulk_load([('a/b/c', 1), ('a/b/d', 2), ('e', 3)])
+            >>> T['a/b'], T['a/b/c'], T['a/b/d'], T['e']
+            (None, 1, 2, 3)
+            >>> T.update_many([('a/b/c', 4), ('a/x', 5)])
+            >>> T['a/b/c'], T['a/x']
+            (4, 5)
+
+        """
+        keys = []
+        nodes = [self]
+        for path, value in items:
+            path = self.norm_path(path)
+            common = 0
+            limit = min(len(path), len(keys))
+            while common < limit and path[common] == keys[common]:
+                common += 1
+            del keys[common:]
+            del nodes[common + 1:]
+            node = nodes[-1]
+            for i in xrange(common, len(path)):
+                node = node.add_child(path[i])
+                keys.append(path[i])
+                nodes.append(node)
+            node.value = value
+
+    def longest_prefix(self, path):
+        """Return (node, suffix): the deepest existing node along 'path', and
+        the list of components of 'path' beyond it. This is a single descent,
+        so its cost depends only on the depth of 'path'.
+
+            >>> T = Tree.bulk_load([('blog/2016', 'archive'), ('docs', 'docs')])
+            >>> node, suffix = T.longest_prefix('/blog/2016/03/hello')
+            >>> node.value, suffix
+            ('archive', ['03', 'hello'])
+
+        """
+        path = self.norm_path(path)
+        node = self
+        for i, key in enumerate(path):
+            child = node.children.get(key)
+            if child is None:
+                return node, path[i:]
+            node = child
+        return node, []
+
+    def glob(self, pattern):
+        """Generate (path, node) for every node whose path matches 'pattern'.
+        String components of 'pattern' may contain the shell-style wildcards
+        of the fnmatch module; each matches a single path component.
+
+        Components without wildcards are looked up directly, and only
+        wildcard components cost a scan of the children at their level.
+
+            >>> T = Tree.bulk_load([('blog/a/comments', 1), ('blog/b/comments', 2),
+            ...                     ('blog/b/edit', 3), ('docs/a/comments', 4)])
+            >>> sorted((p, n.value) for p, n in T.glob('/blog/*/comments'))
+            [(['blog', 'a', 'comments'], 1), (['blog', 'b', 'comments'], 2)]
+            >>> sorted(p for p, n in T.glob('*/a/[c]*'))
+            [['blog', 'a', 'comments'], ['docs', 'a', 'comments']]
+
+        """
+        pattern = self.norm_path(pattern)
+        level = [([], self)]
+        for component in pattern:
+            matches = []
+            if isinstance(component, basestring) and has_magic(component):
+                for path, node in level:
+                    for key, child in node.children.iteritems():
+                        if (isinstance(key, basestring)
+                                and fnmatchcase(key, component)):
+                            matches.append((path + [key], child))
+            else:
+                for path, node in level:
+                    child = node.children.get(component)
+                    if child is not None:
+                        matches.append((path + [component], child))
+            level = matches
+        return iter(level)
+
+    def setdefault(self, path, default=None):
+        """Return the value at 'path', first setting it to 'default' if that
+        node does not exist. The tree is descended only once.
+
+            >>> T = Tree()
+            >>> T['a'] = None
+            >>> T.setdefault('a/b', 1), T.setdefault('a/b', 2)
+            (1, 1)
+
+        """
+        path = self.norm_path(path)
+        if len(path) == 0:
+            return self.value
+        parent = self._parent_node(path)
+        child = parent.children.get(path[-1])
+        if child is None:
+            child = parent.add_child(path[-1])
+            child.value = default
+        return child.value
+
+    def add_child(self, key):
+        """Return the child node at 'key', creating it if necessary."""
+        try:
+            return self.children[key]
+        except KeyError:
+            child = self.children[key] = self.__class__()
+            return child
 
     def __delitem__(self, path):
         path = self.norm_path(path)
-        del self.node(path[:-1]).children[path[-1]]
+        del self._parent_node(path).children[path[-1]]
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __len__(self):
+        return len(self.children)
 
     def __str__(self):
         return "\n".join(
-                ["/%s\t%s\t%s" % ('/'.join([str(x) for x in p]), t.value, t.__class__.__name__) for t, p in walk(self)])
+                ["/%s\t%s\t%s" % ('/'.join([str(x) for x in p]), t.value, t.__class__.__name__) for t, p in self.walk(depth=True)])
 
 
-class FdTree(object):
+class _NoChildren(collections.Mapping):
+    """The shared, empty, read-only children mapping of CompactTreeNode
+    leaves.
+
+    """
+    def __getitem__(self, key):
+        raise KeyError(key)
+
+    def __delitem__(self, key):
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(())
+
+    def __len__(self):
+        return 0
+
+_NO_CHILDREN = _NoChildren()
+
+
+class CompactTreeNode(GeneralTreeNode):
+    """A GeneralTreeNode that stores its value and children in __slots__, and
+    creates its children dict only when its first child is added.
+
+    Use it like GeneralTreeNode when a tree has so many nodes that their
+    per-instance overhead matters. Leaves share a single read-only empty
+    children mapping; use add_child() or item assignment to add children.
+
+        >>> T = CompactTree()
+        >>> T['a'] = 1
+        >>> T['a/b'] = 2
+        >>> T['a/b'], len(T.node(['a'])), len(T.node(['a', 'b']))
+        (2, 1, 0)
+        >>> T.node(['a', 'b']).children['c'] = 3
+        Traceback (most recent call last):
+            ...
+        AttributeError: __setitem__
+
+    """
+    __slots__ = ('value', '_children')
+
+    def __init__(self):
+        self.value = None
+        self._children = None
+
+    @property
+    def children(self):
+        if self._children is None:
+            return _NO_CHILDREN
+        return self._children
 
-    # XXX Abandoned: if we don't try to get all abstract and just assume the
-    # pathnames are strings, we can use a shelve to store the data. So let's
-    # make an object specific for the task. Site?
+    def add_child(self, key):
+        """Return the child node at 'key', creating it if necessary."""
+        if self._children is None:
+            self._children = dict()
+        try:
+            return self._children[key]
+        except KeyError:
+            child = self._children[key] = self.__class__()
+            return child
 
+
+class FdTree(object):
     """Flat Dictionary Hierarchical Mapping
 
     This class implements a basic hierarchical container, using a dict for
     storage. It does little more than add a parent/child management layer atop
     a regular dict. Requesting a branch returns the data stored at that branch.
 
-    It is expensive (and presently unimplemented) to request a sub-tree
-    rooted at a particular branch.
+    Paths are tuples of path components. As with dict objects, components must
+    be immutable, but need not be strings. Parents are implicitly created with
+    the value None.
+
+    Alongside the flat dict, an index maps each path to the set of paths of
+    its children. Children and parents are found without scanning the dict,
+    and enumerating a subtree costs time proportional to its size. This
+    layout suits shallow, wide trees: lookups are a single dict access, and
+    iterating the whole tree is iterating one dict.
+
+        >>> T = FdTree()
+        >>> T['a', 'b', 'c'] = 1
+        >>> T['a', 'b', 'd'] = 2
+        >>> T['a', 'e'] = 3
+        >>> T['a', 'b'], T['a', 'b', 'd']
+        (None, 2)
+        >>> sorted(T.children_items(('a', 'b')))
+        [(('a', 'b', 'c'), 1), (('a', 'b', 'd'), 2)]
+        >>> list(T.parents_items(('a', 'b', 'c')))
+        [((), None), (('a',), None), (('a', 'b'), None)]
+        >>> sorted(T.descendants(('a',)))
+        [('a', 'b'), ('a', 'b', 'c'), ('a', 'b', 'd'), ('a', 'e')]
+        >>> del T['a', 'b']
+        >>> sorted(T)
+        [(), ('a',), ('a', 'e')]
+        >>> T.is_branch(('a',)), T.is_branch(('a', 'e'))
+        (True, False)
 
-    As with dict objects, keys must be immutable, but need not be strings.
     """
 
     def __init__(self, tree=None):
         self.tree = tree or dict()
+        self._children = dict()
+        for path in self.tree:
+            if path:
+                self._children.setdefault(path[:-1], set()).add(path)
 
     def norm_path(self, path):
         if not isinstance(path, tuple):
@@ -338,42 +716,89 @@ class FdTree(object):
 
     def __getitem__(self, path):
         path = self.norm_path(path)
-        return self.tree(path)
+        return self.tree[path]
 
     def __setitem__(self, path, value):
         path = self.norm_path(path)
+        if path not in self.tree:
+            # Create missing parents, nearest first, stopping at the first
+            # one that exists.
+            child = path
+            while child:
+                parent = child[:-1]
+                self._children.setdefault(parent, set()).add(child)
+                if parent in self.tree:
+                    break
+                self.tree[parent] = None
+                child = parent
         self.tree[path] = value
 
     def __delitem__(self, path):
         path = self.norm_path(path)
-        del self.node(path[:-1]).children[path[-1]]
+        if path not in self.tree:
+            raise KeyError(path)
+        for p in list(self.descendants(path)):
+            del self.tree[p]
+            self._children.pop(p, None)
+        del self.tree[path]
+        self._children.pop(path, None)
+        if path:
+            self._children[path[:-1]].discard(path)
 
-    def is_branch(self, node):
-        """True if the node contains children"""
-        pass
+    def __contains__(self, path):
+        return self.norm_path(path) in self.tree
+
+    def __iter__(self):
+        return iter(self.tree)
+
+    def __len__(self):
+        return len(self.tree)
+
+    def is_branch(self, path):
+        """True if the node at path contains children"""
+        return bool(self._children.get(self.norm_path(path)))
 
     def children_keys(self, path):
         """Return an iterable of paths of children of the specified path."""
-        pass
+        path = self.norm_path(path)
+        return list(self._children.get(path, ()))
 
     def children_items(self, path):
         """Return an iterable of children (path, value) of the specified
         path. (Imagine a call to itervalues() filtered to children of
         path.)"""
-        pass
+        tree = self.tree
+        return [(p, tree[p]) for p in self.children_keys(path)]
+
+    def descendants(self, path):
+        """Generate the paths of every descendant of the specified path, in
+        depth-first order.
+
+        """
+        path = self.norm_path(path)
+        index = self._children
+        stack = [iter(list(index.get(path, ())))]
+        while stack:
+            for p in stack[-1]:
+                yield p
+                if p in index:
+                    stack.append(iter(list(index[p])))
+                break
+            else:
+                stack.pop()
 
     def parents_keys(self, path):
         """Return an iterable of paths of parents of the specified path."""
         path = self.norm_path(path)
         if path not in self.tree:
-            raise KeyError()
-            return self.context(path)
+            raise KeyError(path)
+        return self.context(path)
 
     def parents_items(self, path):
-        """Return an iterable of children (path, value) of the specified
-        path. (Imagine a call to itervalues() filtered to children of
-        path.)"""
-
+        """Return an iterable of parents (path, value) of the specified
+        path, starting with the root."""
+        tree = self.tree
+        return ((p, tree[p]) for p in self.parents_keys(path))
 
     @classmethod
     def context(self, path):
@@ -393,15 +818,31 @@ class NdloTree(object):
     This class implements a basic hierarchical container, using nested dicts
     for storage. Requesting a branch returns a new NdloTree object rooted at
     that branch.
-    """
-    # XXX FIXME unfinished
 
-    def __init__(self, tree=None):
-        self.tree = tree or dict()
+    That object is a view: it is bound to the branch's own dict, so it copies
+    nothing, changes made through it are seen by the whole tree, and
+    operations on it need not descend from the root again. Its 'prefix' is the
+    path of the branch within the original tree.
+
+        >>> T = NdloTree()
+        >>> T[['site']] = {}
+        >>> T[['site', 'blog']] = {}
+        >>> blog = T[['site', 'blog']]
+        >>> blog.prefix
+        ('site', 'blog')
+        >>> blog[['first-post']] = 'Hello'
+        >>> T[['site', 'blog', 'first-post']]
+        'Hello'
+        >>> sorted(T.subtree(['site']).children(['blog']))
+        ['first-post']
 
-    def is_branch(self, node):
-        """True if the node is a dict containing the special index_node_key."""
-        return isinstance(node, dict) and self.index_node_key in node
+    """
+
+    def __init__(self, tree=None, prefix=()):
+        if tree is None:
+            tree = dict()
+        self.tree = tree
+        self.prefix = tuple(prefix)
 
     def is_branch(self, node):
         return isinstance(node, dict)
@@ -409,8 +850,8 @@ class NdloTree(object):
     def children(self, path):
         """List the children of a particular path"""
         node = self[path]
-        if self.is_branch(node):
-            return node.keys()
+        if isinstance(node, NdloTree):
+            return node.tree.keys()
         return []
 
     def norm_path(self, path):
@@ -418,13 +859,23 @@ class NdloTree(object):
             raise AttributeError("Not a list of path components: %s" % path)
         return path
 
+    def subtree(self, path):
+        """Return a view of the branch at 'path'."""
+        path = self.norm_path(path)
+        node = self.tree
+        for p in path:
+            node = node[p]
+        if not self.is_branch(node):
+            raise KeyError("Not a branch: %s" % repr(path))
+        return self.__class__(node, self.prefix + tuple(path))
+
     def __getitem__(self, path):
         path = self.norm_path(path)
         node = self.tree
         for p in path:
             node = node[p]
         if self.is_branch(node):
-            return self.__class__(node)
+            return self.__class__(node, self.prefix + tuple(path))
         return node
 
     def __setitem__(self, path, value):
@@ -432,15 +883,17 @@ class NdloTree(object):
         node = self.tree
         for p in path[:-1]:
             node = node[p]
-        if self.is_branch(node) and len(node) > 0:
-            raise AttributeError("Path is a branch with children; delete children or path first.")
         if len(path) == 0:
             self.tree = value
-        else:
-            node[path[-1]] = value
+            return
+        existing = node.get(path[-1])
+        if self.is_branch(existing) and len(existing) > 0:
+            raise AttributeError("Path is a branch with children; delete children or path first.")
+        node[path[-1]] = value
 
     def __delitem__(self, path):
         path = self.norm_path(path)
+        node = self.tree
         for p in path[:-1]:
             node = node[p]
         del node[path[-1]]
@@ -459,13 +912,35 @@ class NestedDictionaryTree(object):
     "manages" a structure of nested dicts, and relies upon
     a "special key" per dict to contain branch nodes'
     "value."
+
+    subtree() returns a view bound to the dict of one branch, with the
+    branch's path in the original tree as its 'prefix'. Nothing is copied, and
+    operations on the view start from that branch rather than from the root.
+
+        >>> T = NestedDictionaryTree()
+        >>> T[['docs']] = None
+        >>> T[['docs', 'api']] = None
+        >>> T[['docs', 'api', 'tree']] = 'tree docs'
+        >>> api = T.subtree(['docs', 'api'])
+        >>> api.prefix
+        ('docs', 'api')
+        >>> api[['fstree']] = 'fstree docs'
+        >>> T[['docs', 'api', 'fstree']]
+        'fstree docs'
+        >>> del api[['tree']]
+        >>> sorted(T.children(['docs', 'api']))
+        ['fstree', 'index']
+
     """
 
     # XXX FIXME unfinished.
 
-    def __init__(self, tree=None, index_node_key='index'):
-        self.tree = tree or dict()
+    def __init__(self, tree=None, index_node_key='index', prefix=()):
+        if tree is None:
+            tree = dict()
+        self.tree = tree
         self.index_node_key = index_node_key
+        self.prefix = tuple(prefix)
         if self.index_node_key not in self.tree:
             self.tree[self.index_node_key] = None
 
@@ -475,7 +950,9 @@ class NestedDictionaryTree(object):
 
     def children(self, path):
         """List the children of a particular path"""
-        node = self[path]
+        node = self.tree
+        for p in self.norm_path(path):
+            node = node[p]
         if self.is_branch(node):
             return node.keys()
         return []
@@ -485,6 +962,20 @@ class NestedDictionaryTree(object):
             raise AttributeError("Not a list of path components: %s" % path)
         return path
 
+    def subtree(self, path):
+        """Return a view of the branch at 'path'. A leaf there is first
+        converted to a branch that holds its value.
+
+        """
+        path = self.norm_path(path)
+        node = self.tree
+        for p in path:
+            if not self.is_branch(node[p]):
+                node[p] = { self.index_node_key: node[p] }
+            node = node[p]
+        return self.__class__(node, self.index_node_key,
+                              self.prefix + tuple(path))
+
     def __getitem__(self, path):
         path = self.norm_path(path)
         node = self.tree
@@ -505,14 +996,17 @@ class NestedDictionaryTree(object):
                 node[p] = { self.index_node_key: node[p] }
             node = node[p]
         for p in path[-1:]:
-            if self.is_branch(node):
+            if self.is_branch(node.get(p)):
                 node[p][self.index_node_key] = value
             else:
                 node[p] = value
 
     def __delitem__(self, path):
         path = self.norm_path(path)
-        del self.node(path[:-1]).children[path[-1]]
+        node = self.tree
+        for p in path[:-1]:
+            node = node[p]
+        del node[path[-1]]
 
     def __str__(self):
         return "\n".join(
@@ -617,24 +1111,826 @@ class StringPathsOnlyMixin(object):
         return super(StringPathsOnlyMixin, self).norm_path(path)
 
 
-class Tree(StringSplitMixin, TuplePathsMixin, OneLevelMixin, GeneralTreeNode):
+# The most entries a class's cache of normalized paths holds; when it is full,
+# it is cleared and starts over.
+PATH_CACHE_SIZE = 10000
+
+
+class _PathCache(dict):
+    """A dict of normalized paths, which also counts the lookups that found
+    their path in it ('hits') and that did not ('misses'). The counts are
+    kept when it is cleared.
+
+    """
+    __slots__ = ('hits', 'misses')
+
+    def __init__(self):
+        dict.__init__(self)
+        self.hits = 0
+        self.misses = 0
+
+
+def path_cache(cls):
+    """Return the dict in which instances of 'cls' remember the normalized
+    forms of string paths, creating it if necessary. Its 'hits' and
+    'misses' attributes count the lookups that did and did not find their
+    path in it; under threads, these counts are approximate.
+
+    Each class has its own cache, as subclasses may normalize paths
+    differently. A hit is a plain dict lookup, and the cache is never
+    reordered, only cleared when full, so that every operation on it is
+    atomic under the GIL and threads may share it.
+
+        >>> T = Tree()
+        >>> T['/a'] = 1
+        >>> path_cache(Tree)['/a']
+        ('a',)
+        >>> path_cache(CompactTree) is path_cache(Tree)
+        False
+
+    """
+    cache = cls.__dict__.get('_path_cache')
+    if cache is None:
+        cache = _PathCache()
+        setattr(cls, '_path_cache', cache)
+    return cache
+
+
+def remember_path(cls, path, normed):
+    """Add the normalized form of the string 'path' to the path cache of
+    'cls', and return it. String components of 'normed' are interned, so that
+    cached paths share storage with each other and with the keys of trees.
+
+    """
+    if isinstance(normed, tuple):
+        normed = tuple([intern(x) if type(x) is str else x for x in normed])
+    elif type(normed) is str:
+        normed = intern(normed)
+    cache = path_cache(cls)
+    cache.misses += 1
+    if len(cache) >= PATH_CACHE_SIZE:
+        cache.clear()
+    cache[path] = normed
+    return normed
+
+
+class CachedPathsMixin(object):
+    """Remembers the normalized form of string paths in the path_cache() of
+    the class, so that repeated lookups of the same path skip
+    re-normalization.
+
+    If used together, this mixin must precede all other mixins that implement
+    norm_path().
+
+        >>> T = Tree()
+        >>> cache = path_cache(Tree)
+        >>> hits, misses = cache.hits, cache.misses
+        >>> T['/counted'] = 1
+        >>> T['counted'] == T['/counted/'] == T['/counted']
+        True
+        >>> cache['/counted/'], cache.hits - hits, cache.misses - misses
+        (('counted',), 1, 3)
+    """
+
+    def norm_path(self, path):
+        if type(path) is not str:
+            return super(CachedPathsMixin, self).norm_path(path)
+        cache = type(self).__dict__.get('_path_cache')
+        if cache is not None:
+            normed = cache.get(path)
+            if normed is not None:
+                cache.hits += 1
+                return list(normed)
+        return list(remember_path(type(self), path,
+                tuple(super(CachedPathsMixin, self).norm_path(path))))
+
+    def update_many(self, items):
+        # A bulk load is typically a long stream of distinct paths, which
+        # would only flush the cache; normalize them without it.
+        norm_path = super(CachedPathsMixin, self).norm_path
+        return super(CachedPathsMixin, self).update_many(
+                (norm_path(path), value) for path, value in items)
+
+
+class CopyOnWriteMixin(object):
+    """Enables O(1) read-only snapshots of a tree, for readers that must not
+    block on (or observe) a writer.
+
+    After a snapshot is taken, the tree and the snapshot share all their
+    nodes. Writes to the tree copy only the nodes on the path from the root
+    to the node being changed, so memory grows only with the changed spine.
+
+    Each node is stamped with the generation in which it became writable,
+    and each snapshot begins a new generation. A node whose stamp differs
+    from its (writable) parent's may be shared with a snapshot, and is
+    copied before it is changed.
+
+    All changes must be made through the tree itself, not through nodes
+    obtained with node(); the latter may be shared with snapshots.
+
+    A snapshot may be taken in one thread while another writes to the tree.
+    snapshot() waits for the write in progress to finish, which for
+    update_many() is the whole batch, so that a snapshot never changes once
+    taken. Writers must still not write to the tree at the same time.
+
+        >>> T = CopyOnWriteTree()
+        >>> T.update_many([('a/b', 1), ('c/d', 2), ('f/g', 5)])
+        >>> S = T.snapshot()
+        >>> T['a/b'] = 3
+        >>> del T['c/d']
+        >>> S['a/b'], T['a/b'], 'd' in S.node(['c']), 'd' in T.node(['c'])
+        (1, 3, True, False)
+        >>> S.node(['a']) is T.node(['a']), S.node(['f']) is T.node(['f'])
+        (False, True)
+        >>> S['e'] = 4
+        Traceback (most recent call last):
+            ...
+        TypeError: Snapshots are read-only
+
+    """
+    _cow_stamp = 0
+    _cow_shared = False
+    _cow_readonly = False
+
+    def snapshot(self):
+        """Return a read-only view of the tree as it is now, in O(1)."""
+        if self._cow_readonly:
+            return self
+        with self._writing_lock():
+            snap = self.__class__()
+            snap.value = self.value
+            snap.children = self.children
+            snap._cow_stamp = self._cow_stamp
+            snap._cow_readonly = True
+            self._cow_shared = True
+        return snap
+
+    def _writing_lock(self):
+        """Return the lock held by snapshot() and by each write, creating it
+        on first use; only the root of a tree ever needs one.
+
+        """
+        lock = self.__dict__.get('_cow_lock')
+        if lock is None:
+            lock = self.__dict__.setdefault('_cow_lock', threading.Lock())
+        return lock
+
+    def _writable_root(self):
+        if self._cow_readonly:
+            raise TypeError('Snapshots are read-only')
+        if self._cow_shared:
+            self.children = dict(self.children)
+            self._cow_stamp += 1
+            self._cow_shared = False
+        return self
+
+    def _writable_child(self, key):
+        """Return the child at 'key', first replacing it with a private copy
+        if it may be shared with a snapshot.
+
+        """
+        child = self.children[key]
+        if child._cow_stamp != self._cow_stamp:
+            copy = self.__class__()
+            copy.value = child.value
+            copy.children = dict(child.children)
+            copy._cow_stamp = self._cow_stamp
+            child = self.children[key] = copy
+        return child
+
+    def _parent_node(self, path):
+        node = self._writable_root()
+        for i in xrange(len(path) - 1):
+            node = node._writable_child(path[i])
+        return node
+
+    def add_child(self, key):
+        if key in self.children:
+            return self._writable_child(key)
+        child = super(CopyOnWriteMixin, self).add_child(key)
+        child._cow_stamp = self._cow_stamp
+        return child
+
+    def __setitem__(self, path, value):
+        with self._writing_lock():
+            self._writable_root()
+            return super(CopyOnWriteMixin, self).__setitem__(path, value)
+
+    def __delitem__(self, path):
+        with self._writing_lock():
+            self._writable_root()
+            return super(CopyOnWriteMixin, self).__delitem__(path)
+
+    def setdefault(self, path, default=None):
+        with self._writing_lock():
+            return super(CopyOnWriteMixin, self).setdefault(path, default)
+
+    def update_many(self, items):
+        with self._writing_lock():
+            self._writable_root()
+            return super(CopyOnWriteMixin, self).update_many(items)
+
+
+class AggregateMixin(object):
+    """Maintains registered aggregates of every subtree incrementally, and
+    notifies subscribers of each changed path.
+
+    An aggregate is a function of a node's value returning a number; the
+    aggregate of a subtree is the sum of that function over all of its nodes,
+    including its root. Each node keeps the totals for its own subtree, and a
+    change to one value adjusts only the totals along the path from the root
+    to that node. So reading a subtree's aggregate costs O(depth), not
+    O(size), and each change costs O(depth) per aggregate.
+
+    All changes must be made through the tree itself, not through nodes
+    obtained with node(), so that the totals stay correct.
+
+        >>> T = AggregateTree.bulk_load([('docs/a', 10), ('docs/b', 20)])
+        >>> T.add_aggregate('nodes', lambda value: 1)
+        >>> T.add_aggregate('size', lambda value: value or 0)
+        >>> T.aggregate('nodes'), T.aggregate('size', 'docs')
+        (4, 30)
+        >>> changed = []
+        >>> T.subscribe(changed.append)
+        >>> T['docs/b'] = 5
+        >>> T.update_many([('blog/2016/hello', 7)])
+        >>> del T['docs/a']
+        >>> T.aggregate('nodes'), T.aggregate('size'), T.aggregate('size', 'blog')
+        (6, 12, 7)
+        >>> changed
+        [['docs', 'b'], ['blog', '2016', 'hello'], ['docs', 'a']]
+
+    Subscribers are called with the path of each node set or deleted, after
+    the change. The descendants removed along with a deleted node are not
+    reported separately.
+
+    """
+    _aggregate_funcs = ()
+    _subscribers = ()
+
+    def __init__(self):
+        super(AggregateMixin, self).__init__()
+        self._totals = {}
+
+    def add_aggregate(self, name, func):
+        """Register the aggregate 'name', computing it for every subtree
+        once, in a single walk of the tree.
+
+        """
+        for node, path in reversed(list(self.walk())):
+            total = func(node.value)
+            for child in node.children.itervalues():
+                total += child._totals[name]
+            node._totals[name] = total
+        self._aggregate_funcs += ((name, func),)
+
+    def aggregate(self, name, path=[]):
+        """Return the aggregate 'name' of the subtree at 'path'."""
+        return self.node(self.norm_path(path))._totals[name]
+
+    def subscribe(self, callback):
+        """Call callback(path) after each change to the tree."""
+        self._subscribers += (callback,)
+
+    def unsubscribe(self, callback):
+        self._subscribers = tuple(
+                c for c in self._subscribers if c != callback)
+
+    def _notify(self, path):
+        for callback in self._subscribers:
+            callback(list(path))
+
+    def _set_aggregated(self, path, value, autocreate):
+        """Set the value at 'path', creating it (and, if 'autocreate' is
+        true, its missing parents), and adjust the totals of its ancestors.
+
+        """
+        spine = [self]
+        node = self
+        for i, key in enumerate(path):
+            child = node.children.get(key)
+            if child is None:
+                break
+            spine.append(child)
+            node = child
+        else:
+            old = node.value
+            node.value = value
+            for name, func in self._aggregate_funcs:
+                delta = func(value) - func(old)
+                for n in spine:
+                    n._totals[name] += delta
+            return
+        missing = path[i:]
+        if len(missing) > 1 and not autocreate:
+            raise KeyError(missing[0])
+        created = [node.add_child(missing[0])]
+        for key in missing[1:]:
+            created.append(created[-1].add_child(key))
+        created[-1].value = value
+        for name, func in self._aggregate_funcs:
+            total = func(value)
+            created[-1]._totals[name] = total
+            if len(created) > 1:
+                empty = func(None)
+                for n in reversed(created[:-1]):
+                    total += empty
+                    n._totals[name] = total
+            for n in spine:
+                n._totals[name] += total
+
+    def __setitem__(self, path, value):
+        path = self.norm_path(path)
+        if self._aggregate_funcs:
+            self._set_aggregated(path, value, autocreate=False)
+        else:
+            super(AggregateMixin, self).__setitem__(path, value)
+        self._notify(path)
+
+    def __delitem__(self, path):
+        path = self.norm_path(path)
+        if self._aggregate_funcs:
+            spine = [self]
+            for key in path[:-1]:
+                spine.append(spine[-1].children[key])
+            removed = spine[-1].children.pop(path[-1])
+            for name, func in self._aggregate_funcs:
+                total = removed._totals[name]
+                for n in spine:
+                    n._totals[name] -= total
+        else:
+            super(AggregateMixin, self).__delitem__(path)
+        self._notify(path)
+
+    def setdefault(self, path, default=None):
+        path = self.norm_path(path)
+        try:
+            return self.node(path).value
+        except KeyError:
+            self[path] = default
+            return default
+
+    def update_many(self, items):
+        if not (self._aggregate_funcs or self._subscribers):
+            return super(AggregateMixin, self).update_many(items)
+        for path, value in items:
+            path = self.norm_path(path)
+            if self._aggregate_funcs:
+                self._set_aggregated(path, value, autocreate=True)
+            else:
+                super(AggregateMixin, self).update_many([(path, value)])
+            self._notify(path)
+
+
+class Tree(CachedPathsMixin, StringSplitMixin, TuplePathsMixin,
+           OneLevelMixin, GeneralTreeNode):
     """A fairly useful and convenient tree, formed by
     combining a GeneralTreeNode with a bunch of useful mixin
     classes.
     """
-    pass
 
 
-class StringPathsTree(StringSplitMixin, TuplePathsMixin, OneLevelMixin,
-                      StringPathsOnlyMixin, GeneralTreeNode):
+class StringPathsTree(CachedPathsMixin, StringSplitMixin, TuplePathsMixin,
+                      OneLevelMixin, StringPathsOnlyMixin, GeneralTreeNode):
     """A fairly useful and convenient tree, formed by
     combining a GeneralTreeNode with a bunch of useful mixin
     classes.
     """
+
+
+class CompactTree(CachedPathsMixin, StringSplitMixin, TuplePathsMixin,
+                  OneLevelMixin, CompactTreeNode):
+    """A Tree built from CompactTreeNodes, for very large trees."""
+    __slots__ = ()
+
+
+class CompactStringPathsTree(CachedPathsMixin, StringSplitMixin,
+                             TuplePathsMixin, OneLevelMixin,
+                             StringPathsOnlyMixin, CompactTreeNode):
+    """A StringPathsTree built from CompactTreeNodes, for very large trees."""
+    __slots__ = ()
+
+
+class CopyOnWriteTree(CopyOnWriteMixin, Tree):
+    """A Tree that supports O(1) read-only snapshots."""
     pass
 
 
-if __name__ == "__main__":
+class AggregateTree(AggregateMixin, Tree):
+    """A Tree that maintains aggregates of every subtree incrementally."""
+    pass
+
+
+class _RadixNode(object):
+    """A node of a RadixTreeNode tree, reached from its parent along 'edge',
+    a tuple of one or more path components.
+
+    """
+    __slots__ = ('edge', 'value', 'children')
+
+    def __init__(self, edge, value=None):
+        self.edge = edge
+        self.value = value
+        self.children = None
+
+
+class _RadixPoint(object):
+    """Stands in for a node in the interior of a compressed edge, which has
+    no node object of its own, when walking a RadixTreeNode.
+
+    """
+    __slots__ = ()
+    value = None
+
+_RADIX_POINT = _RadixPoint()
+
+
+class RadixTreeNode(HierarchicalMapping):
+    """A path-compressed (radix) hierarchical container.
+
+    Where GeneralTreeNode keeps a node object and a dict for every path, this
+    collapses chains of nodes that have the value None and a single child into
+    one edge labeled with all of their path components. Such nodes still
+    exist; they are simply not stored separately. Node objects are kept only
+    for the root, for branches, for leaves, and for nodes with a value.
+
+    As with GeneralTreeNode, paths are lists of components and a node's parent
+    must exist before the node may be set.
+
+        >>> T = RadixStringPathsTree()
+        >>> for p in ['static', 'static/v2', 'static/v2/assets',
+        ...           'static/v2/assets/app.js']:
+        ...     T[p] = None
+        >>> T.children['static'].edge
+        ('static', 'v2', 'assets', 'app.js')
+        >>> T['static/v2'] is None, 'static/v3' in T
+        (True, False)
+        >>> T['static/v2/logo.png'] = 'png'
+        >>> T.children['static'].edge, sorted(T.children['static'].children)
+        (('static', 'v2'), ['assets', 'logo.png'])
+        >>> T['static/v2/assets/app.js'] = 'js'
+        >>> sorted('/'.join(p) for p in T.descendants())
+        ['static', 'static/v2', 'static/v2/assets', 'static/v2/assets/app.js', 'static/v2/logo.png']
+        >>> del T['static/v2/logo.png']
+        >>> T.children['static'].edge
+        ('static', 'v2', 'assets', 'app.js')
+        >>> del T['static/v2/assets']
+        >>> T.children['static'].edge, T['static/v2']
+        (('static', 'v2'), None)
+
+    """
+    edge = ()
+
+    def __init__(self):
+        self.children = None
+        self.value = None
+
+    def norm_path(self, path):
+        if not isinstance(path, list):
+            raise AttributeError("Not a list of path components: %s" % path)
+        return path
+
+    def _find(self, path):
+        """Locate 'path', raising KeyError if it does not exist.
+
+        Return (grandparent, parent, node, depth): the path ends 'depth'
+        components along the edge leading to the node object 'node', whose
+        parent and grandparent node objects are also given.
+
+        """
+        grandparent, parent, node, depth = None, None, self, 0
+        for key in path:
+            if depth < len(node.edge):
+                if node.edge[depth] != key:
+                    raise KeyError(key)
+                depth += 1
+                continue
+            children = node.children
+            if not children or key not in children:
+                raise KeyError(key)
+            grandparent, parent, node, depth = parent, node, children[key], 1
+        return grandparent, parent, node, depth
+
+    def _split(self, parent, node, depth):
+        """Give the point 'depth' components along node's edge a node object
+        of its own, and return it.
+
+        """
+        upper = _RadixNode(node.edge[:depth])
+        node.edge = node.edge[depth:]
+        upper.children = {node.edge[0]: node}
+        parent.children[upper.edge[0]] = upper
+        return upper
+
+    def _merge(self, parent, node):
+        """If 'node' no longer needs a node object of its own, fold it into
+        the edge leading to its only child.
+
+        """
+        if (node is self or node.value is not None or not node.children
+                or len(node.children) != 1):
+            return
+        child, = node.children.values()
+        child.edge = node.edge + child.edge
+        parent.children[child.edge[0]] = child
+
+    def __getitem__(self, path):
+        path = self.norm_path(path)
+        grandparent, parent, node, depth = self._find(path)
+        if depth < len(node.edge):
+            return None
+        return node.value
+
+    def __contains__(self, path):
+        try:
+            self._find(self.norm_path(path))
+        except KeyError:
+            return False
+        return True
+
+    def __setitem__(self, path, value):
+        path = self.norm_path(path)
+        if len(path) == 0:
+            self.value = value
+            return
+        key = path[-1]
+        grandparent, parent, node, depth = self._find(path[:-1])
+        if depth < len(node.edge):
+            # The parent is in the interior of node's edge.
+            if node.edge[depth] != key:
+                node = self._split(parent, node, depth)
+            elif depth + 1 == len(node.edge):
+                node.value = value
+                if value is None:
+                    self._merge(parent, node)
+                return
+            elif value is None:
+                return
+            else:
+                self._split(parent, node, depth + 1).value = value
+                return
+        children = node.children
+        if children and key in children:
+            child = children[key]
+            if len(child.edge) == 1:
+                child.value = value
+                if value is None:
+                    self._merge(node, child)
+            elif value is not None:
+                self._split(node, child, 1).value = value
+        elif node is not self and not children and node.value is None:
+            # Extend the edge leading to a bare leaf.
+            node.edge += (key,)
+            node.value = value
+        else:
+            if children is None:
+                children = node.children = dict()
+            children[key] = _RadixNode((key,), value)
+
+    def __delitem__(self, path):
+        path = self.norm_path(path)
+        if len(path) == 0:
+            raise KeyError('Cannot delete the root')
+        grandparent, parent, node, depth = self._find(path)
+        if depth > 1:
+            # Cut the edge short; the remaining points end in a bare leaf.
+            parent.children[node.edge[0]] = _RadixNode(node.edge[:depth - 1])
+            return
+        del parent.children[node.edge[0]]
+        if not parent.children:
+            parent.children = None
+        elif grandparent is not None:
+            self._merge(grandparent, parent)
+
+    def __iter__(self):
+        return iter(self.children or ())
+
+    def __len__(self):
+        return len(self.children or ())
+
+    def _points(self, node, depth):
+        """Return [(key, (node, depth))] for the children of the point
+        'depth' components along node's edge.
+
+        """
+        if depth < len(node.edge):
+            return [(node.edge[depth], (node, depth + 1))]
+        return [(key, (child, 1))
+                for key, child in (node.children or {}).iteritems()]
+
+    def walk(self, path=[], callback=None, depth=False):
+        """As HierarchicalMapping.walk(). Nodes in the interior of an edge
+        are represented by a placeholder whose value is None.
+
+        """
+        keys = list(self.norm_path(path))
+        grandparent, parent, node, offset = self._find(keys)
+        path = WalkPath.from_keys(keys)
+        if depth:
+            return self._walk_points_depth_first(node, offset, path, callback)
+        return self._walk_points_breadth_first(node, offset, path, callback)
+
+    def _point_node(self, node, depth):
+        if depth < len(node.edge):
+            return _RADIX_POINT
+        return node
+
+    def _walk_points_depth_first(self, node, depth, path, callback):
+        points = dict(self._points(node, depth))
+        keys = list(points)
+        current = self._point_node(node, depth)
+        if callback is not None:
+            callback(current, path, keys)
+        yield current, path
+        stack = [(points, path, iter(keys))]
+        while stack:
+            points, parent_path, keys = stack[-1]
+            for key in keys:
+                node, depth = points[key]
+                path = WalkPath(parent_path, key)
+                child_points = dict(self._points(node, depth))
+                child_keys = list(child_points)
+                current = self._point_node(node, depth)
+                if callback is not None:
+                    callback(current, path, child_keys)
+                yield current, path
+                stack.append((child_points, path, iter(child_keys)))
+                break
+            else:
+                stack.pop()
+
+    def _walk_points_breadth_first(self, node, depth, path, callback):
+        queue = collections.deque([(node, depth, path)])
+        while queue:
+            node, depth, path = queue.popleft()
+            points = dict(self._points(node, depth))
+            keys = list(points)
+            current = self._point_node(node, depth)
+            if callback is not None:
+                callback(current, path, keys)
+            yield current, path
+            for key in keys:
+                child, child_depth = points[key]
+                queue.append((child, child_depth, WalkPath(path, key)))
+
+
+class RadixStringPathsTree(CachedPathsMixin, StringSplitMixin, TuplePathsMixin,
+                           OneLevelMixin, StringPathsOnlyMixin, RadixTreeNode):
+    """A StringPathsTree that stores chains of single-child nodes as single
+    edges. See RadixTreeNode.
+    """
+
+
+def _tree_bytes(root):
+    """Estimate the memory used by the nodes of a tree, not counting keys or
+    values: each node object itself, plus any dicts or edge tuples it owns.
+
+    """
+    import gc
+    import sys
+    total = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        stack.extend((node.children or {}).values())
+        total += sys.getsizeof(node)
+        # gc.get_referents() sees an instance __dict__ only if one was
+        # actually allocated; merely checking node.__dict__ would create it.
+        for ref in gc.get_referents(node):
+            if type(ref) is dict:
+                total += sys.getsizeof(ref)
+                for subref in gc.get_referents(ref):
+                    if type(subref) is dict:
+                        total += sys.getsizeof(subref)
+            elif type(ref) is tuple:
+                total += sys.getsizeof(ref)
+    return total
+
+
+def _benchmark():
+    """Compare the memory footprint of the various tree classes, and time
+    walking them.
+
+    """
+    import timeit
+    for cls in (Tree, CompactTree):
+        T = cls()
+        for i in range(100):
+            T['section%d' % i] = None
+        for i in range(100000):
+            T['section%d/page%d' % (i % 100, i)] = i
+        print '%-20s %6.1f bytes/node' % (
+                cls.__name__, _tree_bytes(T) / 100101.)
+        for depth in (False, True):
+            start = timeit.default_timer()
+            for node, path in T.walk(depth=depth):
+                pass
+            elapsed = timeit.default_timer() - start
+            print '%-20s walk(depth=%s) %.0f nodes/sec' % (
+                    cls.__name__, depth, 100101 / elapsed)
+
+    # A path cache hit, against normalizing the path.
+    T = Tree()
+    path = '/section42/page4242/'
+    T.norm_path(path)
+    for label, norm_path in [
+            ('cached', T.norm_path),
+            ('uncached', super(CachedPathsMixin, T).norm_path)]:
+        timer = timeit.Timer(lambda: norm_path(path))
+        best = min(timer.repeat(repeat=3, number=100000)) / 100000
+        print 'Tree.norm_path() %-8s %.2f usec' % (label, best * 1e6)
+
+    T = node = GeneralTreeNode()
+    for i in range(20000):
+        node = node.add_child(i)
+    start = timeit.default_timer()
+    count = sum(1 for node, path in T.walk(depth=True))
+    elapsed = timeit.default_timer() - start
+    print 'walk() of a %d-level chain: %.2f msec' % (count, elapsed * 1e3)
+
+    paths = ['section%03d/page%06d' % (i // 1000, i) for i in xrange(500000)]
+    start = timeit.default_timer()
+    T = Tree()
+    for i in xrange(500):
+        T['section%03d' % i] = None
+    for path in paths:
+        T[path] = path
+    elapsed = timeit.default_timer() - start
+    print 'Tree item assignment: %.0f paths/sec' % (len(paths) / elapsed)
+    start = timeit.default_timer()
+    T = Tree.bulk_load((path, path) for path in paths)
+    elapsed = timeit.default_timer() - start
+    print 'Tree.bulk_load(): %.0f paths/sec' % (len(paths) / elapsed)
+
+    T = StringPathsTree.bulk_load(
+            ('static/v2/assets/js/vendor/pkg%05d/dist/umd/min/index.js' % i,
+             i) for i in xrange(20000))
+    paths = ['/'.join(p) for p in T.descendants()]
+    leaves = [p for p in paths if p.endswith('.js')]
+    R = RadixStringPathsTree()
+    for path in paths:
+        R[path] = T[path]
+    for tree in (T, R):
+        start = timeit.default_timer()
+        for path in leaves:
+            tree[path]
+        elapsed = timeit.default_timer() - start
+        print '%-20s %6.1f bytes/path, lookup %.0f/sec' % (
+                tree.__class__.__name__,
+                _tree_bytes(tree) / float(len(paths) + 1),
+                len(leaves) / elapsed)
+
+    paths = [('section%03d' % (i // 1000), 'page%06d' % i)
+             for i in xrange(200000)]
+    for cls in (GeneralTreeNode, FdTree):
+        T = cls()
+        if cls is GeneralTreeNode:
+            # GeneralTreeNode requires lists, and parents to exist.
+            for i in xrange(200):
+                T[['section%03d' % i]] = None
+            lookup_paths = [list(p) for p in paths]
+            iterate = lambda: sum(1 for node in T.walk(depth=True))
+        else:
+            lookup_paths = paths
+            iterate = lambda: sum(1 for path in T)
+        start = timeit.default_timer()
+        for path in lookup_paths:
+            T[path] = path
+        insert = timeit.default_timer() - start
+        start = timeit.default_timer()
+        for path in lookup_paths:
+            T[path]
+        lookup = timeit.default_timer() - start
+        start = timeit.default_timer()
+        count = iterate()
+        iteration = timeit.default_timer() - start
+        print '%-20s insert %.0f/sec, lookup %.0f/sec, iterate %.0f/sec' % (
+                cls.__name__, len(paths) / insert, len(paths) / lookup,
+                count / iteration)
+
+    # Updating a section, then reading its total size: re-walking the
+    # section, against reading an aggregate kept up to date incrementally.
+    paths = ['section%03d/page%06d' % (i // 1000, i) for i in xrange(200000)]
+    for cls in (Tree, AggregateTree):
+        T = cls.bulk_load((path, 1) for path in paths)
+        if cls is AggregateTree:
+            T.add_aggregate('size', lambda value: value or 0)
+            size = lambda path: T.aggregate('size', path)
+        else:
+            size = lambda path: sum(node.value or 0
+                                    for node, p in T.walk(path))
+        start = timeit.default_timer()
+        for path in paths[::100]:
+            T[path] = 2
+            size(path.partition('/')[0])
+        elapsed = timeit.default_timer() - start
+        print '%-20s update and read a section size: %.0f/sec' % (
+                cls.__name__, len(paths[::100]) / elapsed)
+
+
+if __name__ == "__main__" and sys.argv[1:] == ['benchmark']:
+    _benchmark()
+elif __name__ == "__main__":
     T = Tree()
     T[[]]        = "Example 0 (/)"
     T[['a']]     = "Example 1 (/a)"
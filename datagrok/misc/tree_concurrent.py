@@ -0,0 +1,381 @@
+"""A thread-safe Tree, locked per top-level subtree.
+
+ConcurrentTree wraps a Tree so that it may be shared by the threads of a
+threaded server. Rather than serialize every access behind one lock, it
+guards each top-level subtree with a reader/writer lock chosen by hashing the
+subtree's name (lock striping), so that a writer to /blog does not block
+readers of /docs.
+
+    >>> T = ConcurrentTree()
+    >>> T['blog'] = 'Blog'
+    >>> T['blog/2016'] = 'Archive'
+    >>> T['docs'] = 'Docs'
+    >>> T['blog/2016'], sorted(T), 'blog/2017' in T
+    ('Archive', ['blog', 'docs'], False)
+    >>> [list(p) for p in T.descendants('blog')]
+    [['blog', '2016']]
+
+To make several changes to one subtree atomically, or to read a consistent
+view of it, lock it and work on its node directly. The node must not be used
+once the block is left, and the ConcurrentTree itself must not be used within
+the block:
+
+    >>> with T.locked('blog', write=True) as blog:
+    ...     blog['2016/03'] = 'March'
+    ...     blog['2016/04'] = 'April'
+    >>> T['blog/2016/04']
+    'April'
+
+An operation within one subtree holds only that subtree's lock. Operations
+that span subtrees, like walking the whole tree, take every lock in order.
+The root's own value and its dict of children are not locked: adding,
+removing and listing top-level subtrees rely upon single dict operations
+being atomic, as they are in CPython.
+
+"""
+from __future__ import absolute_import
+import contextlib
+from glob import has_magic
+import threading
+
+from datagrok.misc.tree import HierarchicalMapping, Tree
+
+
+class ReadWriteLock(object):
+    """A lock that may be held by many readers or by one writer.
+
+    Waiting writers take precedence over new readers, so a stream of readers
+    cannot starve a writer. The lock is not reentrant.
+
+        >>> lock = ReadWriteLock()
+        >>> lock.acquire_read(); lock.acquire_read()
+        >>> lock.release_read(); lock.release_read()
+        >>> lock.acquire_write(); lock.release_write()
+
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._cond = threading.Condition(self._mutex)
+        self._readers = 0
+        self._writer = False
+        self._waiting = 0
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._mutex:
+            while self._writer or self._writers_waiting:
+                self._waiting += 1
+                self._cond.wait()
+                self._waiting -= 1
+            self._readers += 1
+
+    def release_read(self):
+        with self._mutex:
+            self._readers -= 1
+            if not self._readers and self._waiting:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._mutex:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._waiting += 1
+                self._cond.wait()
+                self._waiting -= 1
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._mutex:
+            self._writer = False
+            if self._waiting:
+                self._cond.notify_all()
+
+
+class ConcurrentTree(HierarchicalMapping):
+    """A Tree that may be read and written by many threads at once.
+
+    'tree' is the tree to wrap, which must not be used directly afterward; by
+    default an empty Tree. 'stripes' is the number of subtree locks; distinct
+    top-level subtrees that hash to the same lock contend with each other.
+
+    Walks, descendants() and glob() lock the subtrees they visit only while
+    collecting their results, so they return the (node, path) pairs as they
+    were at that moment. The nodes they return must not be changed.
+
+        >>> T = ConcurrentTree(Tree.bulk_load([('a/b', 1), ('c/d', 2)]),
+        ...                    stripes=4)
+        >>> del T['a/b']
+        >>> sorted(list(p) for p in T.descendants())
+        [['a'], ['c'], ['c', 'd']]
+        >>> T.update_many([('e/f/g', 3)])
+        >>> sorted(p for p, n in T.glob('*/?'))
+        [['c', 'd'], ['e', 'f']]
+        >>> del T['']
+        Traceback (most recent call last):
+            ...
+        KeyError: 'The root cannot be deleted'
+
+    """
+
+    def __init__(self, tree=None, stripes=16):
+        self._tree = Tree() if tree is None else tree
+        self._locks = [ReadWriteLock() for i in xrange(stripes)]
+
+    def norm_path(self, path):
+        # The path cache of Tree is a plain dict, whose lookups and updates
+        # are each atomic, so it may be shared between threads unlocked.
+        return self._tree.norm_path(path)
+
+    def _lock(self, path):
+        """Return the lock of the subtree containing the non-empty 'path'."""
+        return self._locks[hash(path[0]) % len(self._locks)]
+
+    @contextlib.contextmanager
+    def _locking_all(self, write=False):
+        """Hold every subtree lock."""
+        acquired = []
+        try:
+            for lock in self._locks:
+                if write:
+                    lock.acquire_write()
+                else:
+                    lock.acquire_read()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                if write:
+                    lock.release_write()
+                else:
+                    lock.release_read()
+
+    @contextlib.contextmanager
+    def locked(self, path=[], write=False):
+        """Hold the lock on the subtree containing 'path' while the block
+        runs, yielding the node at 'path'. For the root, hold every lock.
+
+        """
+        path = self.norm_path(path)
+        if not path:
+            with self._locking_all(write):
+                yield self._tree
+            return
+        lock = self._lock(path)
+        if write:
+            lock.acquire_write()
+        else:
+            lock.acquire_read()
+        try:
+            yield self._tree.node(path)
+        finally:
+            if write:
+                lock.release_write()
+            else:
+                lock.release_read()
+
+    # The most frequent operations take their lock without the overhead of a
+    # context manager.
+
+    def __getitem__(self, path):
+        path = self.norm_path(path)
+        if not path:
+            return self._tree.value
+        lock = self._lock(path)
+        lock.acquire_read()
+        try:
+            return self._tree[path]
+        finally:
+            lock.release_read()
+
+    def __setitem__(self, path, value):
+        path = self.norm_path(path)
+        if not path:
+            self._tree.value = value
+            return
+        lock = self._lock(path)
+        lock.acquire_write()
+        try:
+            self._tree[path] = value
+        finally:
+            lock.release_write()
+
+    def __delitem__(self, path):
+        path = self.norm_path(path)
+        if not path:
+            raise KeyError('The root cannot be deleted')
+        lock = self._lock(path)
+        lock.acquire_write()
+        try:
+            del self._tree[path]
+        finally:
+            lock.release_write()
+
+    def setdefault(self, path, default=None):
+        path = self.norm_path(path)
+        if not path:
+            return self._tree.value
+        lock = self._lock(path)
+        lock.acquire_write()
+        try:
+            return self._tree.setdefault(path, default)
+        finally:
+            lock.release_write()
+
+    def update_many(self, items):
+        """Set the value of each path in an iterable of (path, value) pairs,
+        with every subtree locked.
+
+        """
+        with self._locking_all(write=True):
+            self._tree.update_many(items)
+
+    def longest_prefix(self, path):
+        path = self.norm_path(path)
+        if not path:
+            return self._tree, []
+        with self.locked(path[:1]):
+            return self._tree.longest_prefix(path)
+
+    def glob(self, pattern):
+        pattern = self.norm_path(pattern)
+        if (pattern and not (isinstance(pattern[0], basestring) and
+                             has_magic(pattern[0]))):
+            context = self.locked(pattern[:1])
+        else:
+            context = self._locking_all()
+        with context:
+            return iter(list(self._tree.glob(pattern)))
+
+    def walk(self, path=[], callback=None, depth=False):
+        path = self.norm_path(path)
+        with self.locked(path[:1]):
+            return iter(list(self._tree.walk(path, callback, depth)))
+
+    def __iter__(self):
+        return iter(list(self._tree.children))
+
+    def __len__(self):
+        return len(self._tree.children)
+
+
+def _benchmark():
+    """Compare ConcurrentTree with a Tree behind one coarse lock, with
+    several threads each working within its own top-level subtree.
+
+    """
+    import random
+    import time
+    import timeit
+
+    class CoarseTree(object):
+        def __init__(self, tree):
+            self._tree = tree
+            self._lock = threading.Lock()
+
+        def __getitem__(self, path):
+            with self._lock:
+                return self._tree[path]
+
+        def __setitem__(self, path, value):
+            with self._lock:
+                self._tree[path] = value
+
+        @contextlib.contextmanager
+        def locked(self, path=[], write=False):
+            with self._lock:
+                yield self._tree.node(self._tree.norm_path(path))
+
+    sections = ['section%02d' % i for i in xrange(8)]
+
+    def make_tree():
+        return Tree.bulk_load(('%s/page%04d' % (s, i), i)
+                              for s in sections for i in xrange(1000))
+
+    def run(T, nthreads, worker):
+        threads = [threading.Thread(target=worker, args=(T, i))
+                   for i in xrange(nthreads)]
+        start = timeit.default_timer()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return timeit.default_timer() - start
+
+    def mixed(T, i):
+        # Nine reads for every write, within this thread's own section.
+        rand = random.Random(i)
+        section = sections[i % len(sections)]
+        for n in xrange(20000):
+            path = '%s/page%04d' % (section, rand.randrange(1000))
+            if n % 10:
+                T[path]
+            else:
+                T[path] = n
+
+    reads = []
+    writes = []
+
+    def slow_writer_and_readers(T, i):
+        # Thread 0 repeatedly holds the /section00 lock during a slow
+        # (I/O-bound) update; the others serve (I/O-bound) requests reading
+        # their own sections meanwhile, noting the longest any read took.
+        clock = timeit.default_timer
+        deadline = clock() + 0.25
+        if i == 0:
+            n = 0
+            while clock() < deadline:
+                with T.locked('section00', write=True) as node:
+                    time.sleep(0.005)
+                    node['page0000'] = n
+                n += 1
+            writes.append(n)
+            return
+        path = '%s/page0001' % sections[i % len(sections)]
+        count = 0
+        worst = 0
+        while clock() < deadline:
+            start = clock()
+            T[path]
+            worst = max(worst, clock() - start)
+            count += 1
+            time.sleep(0.0005)
+        reads.append((count, worst))
+
+    for name, wrap in [('coarse lock', CoarseTree),
+                       ('ConcurrentTree', ConcurrentTree)]:
+        for nthreads in (1, 4, 8):
+            elapsed = run(wrap(make_tree()), nthreads, mixed)
+            print '%-15s %d threads: %8.0f ops/sec' % (
+                    name, nthreads, 20000 * nthreads / elapsed)
+        del reads[:], writes[:]
+        run(wrap(make_tree()), 8, slow_writer_and_readers)
+        print ('%-15s beside a slow writer (%d updates): 7 threads read %d '
+               'times, slowest read %.1f msec' % (
+                    name, writes[0], sum(c for c, w in reads),
+                    max(w for c, w in reads) * 1e3))
+
+    # Stress: concurrent writers to shared and private subtrees, adding and
+    # removing top-level subtrees, must leave the tree consistent.
+    T = ConcurrentTree(stripes=4)
+
+    def stress(T, i):
+        for n in xrange(2000):
+            if n % 100 == 0 and n:
+                del T['t%d' % i]
+            T.setdefault('t%d' % i, None)
+            T.setdefault('shared/t%d' % i, None)
+            T['shared/t%d/n%d' % (i, n % 50)] = n
+            T['t%d/n%d' % (i, n % 50)] = n
+    T['shared'] = None
+    elapsed = run(T, 8, stress)
+    assert sorted(T) == sorted(['shared'] + ['t%d' % i for i in xrange(8)])
+    assert all(len(list(T.descendants('t%d' % i))) == 50 for i in xrange(8))
+    assert len(list(T.descendants('shared'))) == 8 * 51
+    print 'stress: 8 threads, %d operations: %.2f sec' % (
+            8 * 2000 * 4, elapsed)
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -4,35 +4,228 @@ relationships; values are a simple dict mapping keys to values.
 Special mapping objects are provided to make interaction with the mapping more
 straightforward, hiding instantiation of PathNodes from the user.
 
+    >>> d = PathNodeHeirarchicalContainer()
+    >>> d['a/b'] = 1
+    >>> d['a/c'] = 2
+    >>> d[('a', 'b', 'x')] = 3
+    >>> key = PathNode.from_names(['a', 'b'])
+    >>> d[key], key.depth, key.names
+    (1, 2, ('a', 'b'))
+    >>> sorted(k.names for k in d.siblings(key))
+    [('a', 'b'), ('a', 'c')]
+    >>> [k.names for k in d.children(key)]
+    [('a', 'b', 'x')]
+
 '''
+import collections
+import threading
+import weakref
+
 
 class PathNode(object):
-    '''Abstract superclass of all PathNodes.'''
+    '''A key in a hierarchy: the root, or a named child of another PathNode.
 
-    def __init__(self):
-        self.parent = None # Default = root
-        self.children = []
+    PathNodes are interned and immutable: there is only ever one PathNode for
+    a given parent and name, so equality is identity and hashing is as cheap
+    as for any object. Each knows its parent, and its depth and path are
+    computed once, when it is created. Creation is thread-safe, and each
+    subclass of PathNode interns its own instances.
 
-    @property
-    def siblings(self):
-        if parent:
-            return parent.children
-        return []
+        >>> root = PathNode()
+        >>> a = root.child('a')
+        >>> b = PathNode(a, 'b')
+        >>> b is PathNode.from_names(['a', 'b']), b.parent is a, root is PathNode()
+        (True, True, True)
+        >>> b.path == (root, a, b), b.names, b.depth
+        (True, ('a', 'b'), 2)
+        >>> b.name = 'c'
+        Traceback (most recent call last):
+            ...
+        AttributeError: PathNode is immutable
+
+    '''
+    __slots__ = ('parent', 'name', 'depth', 'path', 'names', '__weakref__')
+    _interned = weakref.WeakValueDictionary()
+    _intern_lock = threading.Lock()
+
+    def __new__(cls, parent=None, name=None):
+        if parent is None and name is not None:
+            raise ValueError('Only the root PathNode has no parent')
+        key = (cls, parent, name)
+        node = cls._interned.get(key)
+        if node is not None:
+            return node
+        with cls._intern_lock:
+            # Another thread may have created the node since we looked.
+            node = cls._interned.get(key)
+            if node is None:
+                node = cls._create(parent, name)
+                cls._interned[key] = node
+        return node
+
+    @classmethod
+    def _create(cls, parent, name):
+        node = object.__new__(cls)
+        set_ = object.__setattr__
+        set_(node, 'parent', parent)
+        set_(node, 'name', name)
+        if parent is None:
+            set_(node, 'depth', 0)
+            set_(node, 'path', (node,))
+            set_(node, 'names', ())
+        else:
+            set_(node, 'depth', parent.depth + 1)
+            set_(node, 'path', parent.path + (node,))
+            set_(node, 'names', parent.names + (name,))
+        return node
+
+    @classmethod
+    def from_names(cls, names):
+        '''Return the PathNode reached from the root through 'names'.'''
+        node = cls()
+        for name in names:
+            node = cls(node, name)
+        return node
+
+    def child(self, name):
+        return self.__class__(self, name)
 
     @property
-    def path(self):
-        '''The sequence of all nodes in the hierarchy from the root to this
-        node.
-        
-        '''
-        for a in self.parent.path:
-            yield a
-        yield self
+    def ancestors(self):
+        '''The PathNodes from the root to the parent of this node.'''
+        return self.path[:-1]
+
+    def __setattr__(self, name, value):
+        raise AttributeError('PathNode is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('PathNode is immutable')
+
+    def __reduce__(self):
+        return (self.__class__, (self.parent, self.name))
+
+    def __repr__(self):
+        return 'PathNode.from_names(%r)' % (self.names,)
+
+
+class PathNodeHeirarchicalContainer(collections.MutableMapping):
+    '''A mapping from PathNodes to values, which also indexes the keys it
+    contains by their parents, so that children and siblings may be found
+    without a scan.
+
+    Keys may be given as PathNodes, as sequences of names, or as
+    slash-separated strings.
+
+        >>> d = PathNodeHeirarchicalContainer()
+        >>> d['/a'] = 1
+        >>> d['/a/b'] = 2
+        >>> del d['/a/b']
+        >>> list(d.children('a')), len(d), d['a']
+        ([], 1, 1)
+
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self._values = {}
+        self._children = collections.defaultdict(set)
+        self.update(*args, **kwargs)
 
-class PathNodeHeirarchicalContainer(dict):
+    @staticmethod
+    def _key(key):
+        if isinstance(key, PathNode):
+            return key
+        if isinstance(key, basestring):
+            key = [name for name in key.split('/') if name]
+        return PathNode.from_names(key)
 
     def __getitem__(self, key):
-        pass
+        return self._values[self._key(key)]
 
     def __setitem__(self, key, value):
-        pass
+        key = self._key(key)
+        if key not in self._values and key.parent is not None:
+            self._children[key.parent].add(key)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        key = self._key(key)
+        del self._values[key]
+        if key.parent is not None:
+            siblings = self._children[key.parent]
+            siblings.discard(key)
+            if not siblings:
+                del self._children[key.parent]
+
+    def __contains__(self, key):
+        return self._key(key) in self._values
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def parent(self, key):
+        return self._key(key).parent
+
+    def ancestors(self, key):
+        '''Return the PathNodes from the root to the parent of 'key', whether
+        or not they are contained.
+
+        '''
+        return self._key(key).ancestors
+
+    def children(self, key):
+        '''Return the contained PathNodes that are children of 'key'.'''
+        children = self._children.get(self._key(key))
+        return frozenset(children) if children else frozenset()
+
+    def siblings(self, key):
+        '''Return the contained PathNodes that share the parent of 'key',
+        including 'key' itself if it is contained.
+
+        '''
+        key = self._key(key)
+        if key.parent is None:
+            return frozenset([key]) if key in self._values else frozenset()
+        return self.children(key.parent)
+
+
+def _benchmark():
+    '''Compare PathNode keys with tuple keys for dict lookups and for finding
+    the children of a key.
+
+    '''
+    import timeit
+    names = [('site', 'section%02d' % (i % 50), 'a', 'b', 'c', 'd', 'e',
+              'page%05d' % i) for i in xrange(20000)]
+    nodes = [PathNode.from_names(n) for n in names]
+    tuples = dict((n, i) for i, n in enumerate(names))
+    container = PathNodeHeirarchicalContainer(
+            (node, i) for i, node in enumerate(nodes))
+    plain = dict((node, i) for i, node in enumerate(nodes))
+    for label, d, keys in [('tuple keys', tuples, names),
+                           ('PathNode keys', plain, nodes)]:
+        start = timeit.default_timer()
+        for i in xrange(10):
+            for key in keys:
+                d[key]
+        elapsed = timeit.default_timer() - start
+        print '%-15s dict lookup: %.0f/sec' % (label, 10 * len(keys) / elapsed)
+
+    parent = names[0][:-1]
+    start = timeit.default_timer()
+    for i in xrange(10):
+        [n for n in tuples if n[:-1] == parent]
+    elapsed = timeit.default_timer() - start
+    print '%-15s children by scan: %.0f/sec' % ('tuple keys', 10 / elapsed)
+    parent = nodes[0].parent
+    start = timeit.default_timer()
+    for i in xrange(10):
+        container.children(parent)
+    elapsed = timeit.default_timer() - start
+    print '%-15s children by index: %.0f/sec' % ('PathNode keys', 10 / elapsed)
+
+
+if __name__ == '__main__':
+    _benchmark()
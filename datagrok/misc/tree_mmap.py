@@ -0,0 +1,338 @@
+"""Compact binary serialization of GeneralTreeNode trees, opened with mmap.
+
+dump() writes a tree to a file made of three tables: a string table holding
+each distinct path component once, a table of encoded values, and a table of
+fixed-size node records. MappedTree opens such a file read-only through mmap.
+Opening reads only the header; nodes are located by binary search on first
+access and values are decoded only when requested. Values are not kept once
+decoded, so memory use does not grow as the tree is read, and each access
+returns a fresh copy that may be changed without affecting the tree.
+
+    >>> import os, tempfile
+    >>> from datagrok.misc.tree import Tree
+    >>> T = Tree.bulk_load([('docs/api', {'title': 'API'}), ('docs/faq', 42),
+    ...                     ('blog', 'Blog')])
+    >>> fd, filename = tempfile.mkstemp()
+    >>> os.close(fd)
+    >>> dump(T, filename)
+    >>> M = MappedTree(filename)
+    >>> M['docs/api'], M['docs/faq'], M['blog'], M['docs']
+    ({'title': 'API'}, 42, 'Blog', None)
+    >>> M['docs/api']['title'] = 'Changed'
+    >>> M['docs/api']
+    {'title': 'API'}
+    >>> sorted(M.node(['docs']).children)
+    ['api', 'faq']
+    >>> sorted(M.descendants()) == sorted(T.descendants())
+    True
+    >>> M['docs/nonexistent']
+    Traceback (most recent call last):
+        ...
+    KeyError: 'nonexistent'
+    >>> M['blog'] = 'Read-only'
+    Traceback (most recent call last):
+        ...
+    TypeError: MappedTree is read-only
+    >>> M.close()
+
+Values are pickled by default; any pair of functions converting values to and
+from strings may be given instead:
+
+    >>> import json
+    >>> dump(T, filename, dumps=json.dumps)
+    >>> M = MappedTree(filename, loads=json.loads)
+    >>> M['docs/api']
+    {u'title': u'API'}
+    >>> M.close()
+    >>> os.remove(filename)
+
+Path components must be strings. The value None is stored without calling the
+encoder.
+
+File layout (all integers little-endian):
+
+    header:       magic, string count, node count, and the offsets of the
+                  tables below
+    string index: (offset, length) of each string in the string data
+    string data:  the path components, concatenated
+    values:       the encoded values, concatenated
+    nodes:        one record per node in breadth-first order, so the
+                  children of each node are contiguous and sorted by key:
+                  (key string, first child, child count, value offset,
+                  value length)
+
+"""
+from __future__ import absolute_import
+import collections
+import cPickle as pickle
+import mmap
+import struct
+
+from datagrok.misc.tree import (HierarchicalMapping, CachedPathsMixin,
+        StringSplitMixin, TuplePathsMixin, OneLevelMixin, Tree)
+
+MAGIC = 'DGTREE\x00\x01'
+_HEADER = struct.Struct('<8sIIQQQQ')
+_STRING = struct.Struct('<QI')
+_NODE = struct.Struct('<IIIQI')
+_NO_KEY = 0xFFFFFFFF
+_NO_VALUE = 0xFFFFFFFF
+
+
+def _dumps(value):
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def dump(tree, filename, dumps=_dumps):
+    """Write a GeneralTreeNode tree to 'filename', encoding its values with
+    'dumps'.
+
+    Values are written as the tree is traversed; only the node and string
+    tables are held in memory.
+
+    """
+    strings = {}
+    order = [(_NO_KEY, tree)]
+    links = []
+    i = 0
+    while i < len(order):
+        node = order[i][1]
+        keys = sorted(node.children)
+        links.append((len(order) if keys else 0, len(keys)))
+        for key in keys:
+            if type(key) is not str:
+                raise TypeError('Path components must be strings, not %s' %
+                                type(key))
+            if key not in strings:
+                strings[key] = len(strings)
+            order.append((strings[key], node.children[key]))
+        i += 1
+
+    string_list = sorted(strings, key=strings.get)
+    with open(filename, 'wb') as f:
+        f.write('\0' * _HEADER.size)
+        strings_at = f.tell()
+        offset = 0
+        for s in string_list:
+            f.write(_STRING.pack(offset, len(s)))
+            offset += len(s)
+        blob_at = f.tell()
+        for s in string_list:
+            f.write(s)
+
+        values_at = f.tell()
+        offset = 0
+        value_refs = []
+        for key, node in order:
+            if node.value is None:
+                value_refs.append((0, _NO_VALUE))
+                continue
+            data = dumps(node.value)
+            f.write(data)
+            value_refs.append((offset, len(data)))
+            offset += len(data)
+
+        nodes_at = f.tell()
+        for (key, node), (first, count), (offset, length) in zip(
+                order, links, value_refs):
+            f.write(_NODE.pack(key, first, count, offset, length))
+
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, len(string_list), len(order),
+                             strings_at, blob_at, values_at, nodes_at))
+
+
+class _MappedFile(object):
+    """The open file and mmap shared by all nodes of a MappedTree."""
+
+    def __init__(self, filename, loads):
+        self.file = open(filename, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.nstrings, self.nnodes, self.strings_at, self.blob_at,
+         self.values_at, self.nodes_at) = _HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a tree file' % repr(filename))
+        self.loads = loads
+        self.strings = {}
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def string(self, i):
+        try:
+            return self.strings[i]
+        except KeyError:
+            offset, length = _STRING.unpack_from(
+                    self.map, self.strings_at + i * _STRING.size)
+            start = self.blob_at + offset
+            s = self.strings[i] = intern(self.map[start:start + length])
+            return s
+
+    def record(self, i):
+        return _NODE.unpack_from(self.map, self.nodes_at + i * _NODE.size)
+
+    def value(self, i):
+        """Decode and return the value of node i, afresh on every call."""
+        key, first, count, offset, length = self.record(i)
+        if length == _NO_VALUE:
+            return None
+        start = self.values_at + offset
+        return self.loads(self.map[start:start + length])
+
+    def child(self, i, key):
+        """Return the index of the child of node i at 'key' by binary
+        search of its sorted children.
+
+        """
+        first, count = self.record(i)[1:3]
+        lo, hi = first, first + count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = self.string(self.record(mid)[0])
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return mid
+        raise KeyError(key)
+
+
+class _MappedChildren(collections.Mapping):
+    """The children of a MappedTreeNode, as a read-only mapping.
+
+    Children are found by binary search until the mapping is iterated; as
+    iterating decodes every key anyway, it also remembers where each child is.
+
+    """
+
+    def __init__(self, mapped, index):
+        self._mapped = mapped
+        self._index = index
+        self._index_of = None
+
+    def __getitem__(self, key):
+        if self._index_of is not None:
+            return MappedTreeNode(self._mapped, self._index_of[key])
+        return MappedTreeNode(self._mapped, self._mapped.child(self._index, key))
+
+    def __iter__(self):
+        if self._index_of is None:
+            mapped = self._mapped
+            first, count = mapped.record(self._index)[1:3]
+            self._keys = [mapped.string(mapped.record(i)[0])
+                          for i in xrange(first, first + count)]
+            self._index_of = dict(zip(self._keys,
+                                      xrange(first, first + count)))
+        return iter(self._keys)
+
+    def __len__(self):
+        return self._mapped.record(self._index)[2]
+
+
+class MappedTreeNode(HierarchicalMapping):
+    """A read-only node of a tree file written by dump(). It may be used
+    like a GeneralTreeNode, except that it cannot be modified.
+
+    """
+
+    def __init__(self, mapped, index=0):
+        self._mapped = mapped
+        self._index = index
+        self._children = None
+
+    @property
+    def value(self):
+        return self._mapped.value(self._index)
+
+    @property
+    def children(self):
+        if self._children is None:
+            self._children = _MappedChildren(self._mapped, self._index)
+        return self._children
+
+    def _find(self, path):
+        mapped = self._mapped
+        index = self._index
+        for key in path:
+            index = mapped.child(index, key)
+        return index
+
+    def node(self, path):
+        if not isinstance(path, list):
+            raise AttributeError("Not a list of path components: %s" % path)
+        return MappedTreeNode(self._mapped, self._find(path))
+
+    def norm_path(self, path):
+        if not isinstance(path, list):
+            raise AttributeError("Not a list of path components: %s" % path)
+        return path
+
+    def __getitem__(self, path):
+        path = self.norm_path(path)
+        return self._mapped.value(self._find(path))
+
+    def __setitem__(self, path, value):
+        raise TypeError('MappedTree is read-only')
+
+    def __delitem__(self, path):
+        raise TypeError('MappedTree is read-only')
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __len__(self):
+        return len(self.children)
+
+
+class MappedTree(CachedPathsMixin, StringSplitMixin, TuplePathsMixin,
+                 OneLevelMixin, MappedTreeNode):
+    """A read-only Tree opened from a file written by dump()."""
+
+    def __init__(self, filename, loads=pickle.loads):
+        MappedTreeNode.__init__(self, _MappedFile(filename, loads))
+
+    def close(self):
+        self._mapped.close()
+
+
+def _benchmark():
+    """Compare opening a dumped tree with unpickling it."""
+    import os
+    import tempfile
+    import timeit
+    T = Tree.bulk_load(('section%03d/page%06d' % (i // 1000, i), 'x' * 100)
+                       for i in xrange(200000))
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        dump(T, filename)
+        start = timeit.default_timer()
+        M = MappedTree(filename)
+        M['section042/page042042']
+        elapsed = timeit.default_timer() - start
+        print 'MappedTree open and first lookup: %.2f msec (%d bytes)' % (
+                elapsed * 1e3, os.path.getsize(filename))
+        start = timeit.default_timer()
+        count = sum(1 for node, path in M.walk(depth=True) if node.value)
+        elapsed = timeit.default_timer() - start
+        print 'MappedTree walk and decode %d values: %.2f sec' % (
+                count, elapsed)
+        M.close()
+
+        with open(filename, 'wb') as f:
+            pickle.dump(T, f, pickle.HIGHEST_PROTOCOL)
+        start = timeit.default_timer()
+        with open(filename, 'rb') as f:
+            P = pickle.load(f)
+        P['section042/page042042']
+        elapsed = timeit.default_timer() - start
+        print 'pickle load and first lookup: %.2f msec (%d bytes)' % (
+                elapsed * 1e3, os.path.getsize(filename))
+    finally:
+        os.remove(filename)
+
+
+if __name__ == "__main__":
+    _benchmark()
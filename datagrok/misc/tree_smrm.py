@@ -70,10 +70,17 @@ class SlashSeparatedMappingMixin(PathTransformerMixin, HierarchicalMappingMixin,
         path = self.transform_path(path)
         return super(SlashSeparatedMappingMixin, self).__setitem__(path, value)
 
+    def __delitem__(self, path):
+        path = self.transform_path(path)
+        return super(SlashSeparatedMappingMixin, self).__delitem__(path)
+
     def ancestors(self, path):
         path = self.transform_path(path)
         return ['/'.join(x) for x in super(SlashSeparatedMappingMixin, self).ancestors(path)]
 
+# Marks the nodes of a mount index at which a sub-mapping is mounted.
+_MOUNT = object()
+
 class SubMappingResolverMixin(HierarchicalMappingMixin):
     '''This will cause failed lookups to also walk up the path looking for a
     mapping type that it can delegate the rest of the path to.
@@ -91,16 +98,130 @@ class SubMappingResolverMixin(HierarchicalMappingMixin):
     >>> data['/a/b/c/d/e/f/']
     'value'
 
+    Values that are mappings are remembered as they are set, in a prefix
+    index of their paths, so a failed lookup costs one probe of the index
+    per path component, then one lookup in each sub-mapping mounted along
+    the path, deepest first. Sub-mappings must therefore be set with
+    item assignment, not with dict methods like update() that bypass it.
+
+    >>> data['/a'] = {('b', 'c', 'x'): 'shadowed'}
+    >>> data['/a/b/c/x'], data['/a/b/c/d/e/f']
+    ('shadowed', 'value')
+    >>> del data['/a/b/c']
+    >>> data['/a/b/c/d/e/f']
+    Traceback (most recent call last):
+        ...
+    KeyError: ('a', 'b', 'c', 'd', 'e', 'f')
+
     '''
+    _mounts = None
+
     def __getitem__(self, path):
         supr = super(SubMappingResolverMixin, self)
         try:
             return supr.__getitem__(path)
         except KeyError, e:
-            for ancestor in reversed(list(supr.ancestors(path))):
+            if self._mounts is None:
+                raise
+            mounts = []
+            node = self._mounts
+            for i, component in enumerate(path):
+                if _MOUNT in node:
+                    mounts.append(i)
+                node = node.get(component)
+                if node is None:
+                    break
+            for i in reversed(mounts):
                 try:
-                    return supr.__getitem__(ancestor)[path[len(ancestor):]]
+                    return supr.__getitem__(path[:i])[path[i:]]
                 except KeyError:
                     continue
-            else:
-                raise e
+            raise e
+
+    def __setitem__(self, path, value):
+        super(SubMappingResolverMixin, self).__setitem__(path, value)
+        if isinstance(value, collections.Mapping):
+            if self._mounts is None:
+                self._mounts = {}
+            node = self._mounts
+            for component in path:
+                node = node.setdefault(component, {})
+            node[_MOUNT] = True
+        elif self._mounts is not None:
+            self._unmount(path)
+
+    def __delitem__(self, path):
+        super(SubMappingResolverMixin, self).__delitem__(path)
+        if self._mounts is not None:
+            self._unmount(path)
+
+    def _unmount(self, path):
+        """Remove 'path' from the mount index, with any nodes of the index
+        left empty.
+
+        """
+        nodes = [self._mounts]
+        for component in path:
+            node = nodes[-1].get(component)
+            if node is None:
+                return
+            nodes.append(node)
+        nodes[-1].pop(_MOUNT, None)
+        for i in xrange(len(path) - 1, -1, -1):
+            if nodes[i + 1]:
+                break
+            del nodes[i][path[i]]
+
+
+def _benchmark():
+    """Time lookups resolved through sub-mappings mounted at thousands of
+    paths, against probing every ancestor of the path.
+
+    """
+    import timeit
+
+    class ProbingResolverMixin(HierarchicalMappingMixin):
+        # The previous implementation.
+        def __getitem__(self, path):
+            supr = super(ProbingResolverMixin, self)
+            try:
+                return supr.__getitem__(path)
+            except KeyError, e:
+                for ancestor in reversed(list(supr.ancestors(path))):
+                    try:
+                        return supr.__getitem__(ancestor)[path[len(ancestor):]]
+                    except KeyError:
+                        continue
+                else:
+                    raise e
+
+    class Indexed(SlashSeparatedMappingMixin, SubMappingResolverMixin,
+                  HierarchicalMappingMixin, dict):
+        pass
+
+    class Probing(SlashSeparatedMappingMixin, ProbingResolverMixin,
+                  HierarchicalMappingMixin, dict):
+        pass
+
+    for depth in (2, 8, 32):
+        for cls in (Probing, Indexed):
+            data = cls()
+            paths = []
+            for i in xrange(5000):
+                mount = '/site%04d' % i
+                sub = cls()
+                rest = '/'.join('d%d' % j for j in xrange(depth))
+                sub[rest] = i
+                data[mount] = sub
+                paths.append('%s/%s' % (mount, rest))
+            paths = [data.transform_path(p) for p in paths]
+            start = timeit.default_timer()
+            for path in paths:
+                data[path]
+            elapsed = timeit.default_timer() - start
+            print '%-8s 5000 mounts, depth %2d: %.0f lookups/sec' % (
+                    cls.__name__, depth + 1, len(paths) / elapsed)
+
+
+if __name__ == "__main__":
+    _benchmark()
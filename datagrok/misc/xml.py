@@ -8,7 +8,11 @@
 XML is crap. Wow, I hate XML.
 
 builder() lets you build your XML crap from a structure made of tuples, lists,
-and dicts.
+and dicts. iter_builder() and write_builder() produce the same XML from the same
+structure, but stream it out instead of building a DOM.
+
+dump_tree() and load_tree() stream datagrok.misc.tree containers to and from
+XML.
 
 But really, why are you using XML in the first place?
 
@@ -21,6 +25,9 @@ the next version...
 """
 from __future__ import absolute_import
 import xml.dom.minidom
+from xml.etree import cElementTree as ElementTree
+from xml.sax.saxutils import XMLGenerator, escape
+import itertools
 
 def builder(tree):
     """Converts a tree structure constructed from intrinsic types (tuples,
@@ -63,3 +70,245 @@ def _builder(doc, node, attrs, children):
         else:
             raise ValueError()
     return node
+
+
+def iter_builder(tree):
+    """Generate the XML text of a tree structure in the form accepted by
+    builder(), in small chunks, without building a DOM.
+
+    Children may be given as any iterable, including generators; they are
+    consumed lazily, as output proceeds. The output matches that of
+    builder(tree).toxml().
+
+        >>> tree = ('feed', {'xmlns': 'http://www.w3.org/2005/Atom'}, [
+        ...     ('title', ['Entries & <stuff>']),
+        ...     ('link', {'href': '/?a=1&b="2"'}),
+        ...     ('entry', {'id': '1'}, (('p', [str(i)]) for i in range(2))),
+        ...     ])
+        >>> print ''.join(iter_builder(tree))
+        <feed xmlns="http://www.w3.org/2005/Atom"><title>Entries &amp; &lt;stuff&gt;</title><link href="/?a=1&amp;b=&quot;2&quot;"/><entry id="1"><p>0</p><p>1</p></entry></feed>
+        >>> tree = ('a', {'b': '"c"'}, ['x<y', ('d', {}), ('e', ['&'])])
+        >>> ''.join(iter_builder(tree)) == builder(tree).toxml()
+        True
+        >>> tree = ('q', {}, ['say "a > b"'])
+        >>> print ''.join(iter_builder(tree))
+        <q>say &quot;a &gt; b&quot;</q>
+        >>> ''.join(iter_builder(tree)) == builder(tree).toxml()
+        True
+
+    """
+    stack = [(None, iter([tree]))]
+    while stack:
+        for child in stack[-1][1]:
+            if isinstance(child, basestring):
+                yield escape(child, _ENTITIES)
+                break
+            if len(child) == 2:
+                if isinstance(child[1], dict): # no children
+                    name, attrs, children = child[0], child[1], None
+                else: # no attrs
+                    name, attrs, children = child[0], None, child[1]
+            elif len(child) == 3:
+                name, attrs, children = child
+            else:
+                raise ValueError()
+            yield '<' + name
+            for key in sorted(attrs or []):
+                yield ' %s="%s"' % (key, escape(attrs[key], _ENTITIES))
+            children = iter(children or [])
+            try:
+                first = next(children)
+            except StopIteration:
+                yield '/>'
+                break
+            yield '>'
+            stack.append((name, itertools.chain([first], children)))
+            break
+        else:
+            name = stack.pop()[0]
+            if name is not None:
+                yield '</%s>' % name
+
+# minidom escapes '"' in text as well as in attribute values.
+_ENTITIES = {'"': '&quot;'}
+
+
+def write_builder(tree, out):
+    """Write the XML text of a tree structure in the form accepted by
+    builder() to the file object 'out', without building a DOM. See
+    iter_builder().
+
+    """
+    for chunk in iter_builder(tree):
+        out.write(chunk)
+
+
+def dump_tree(tree, out, encoding='utf-8'):
+    """Write a hierarchical container to the file object 'out' as XML,
+    without building a document in memory.
+
+    'tree' may be a HierarchicalMapping such as datagrok.misc.tree.Tree, or a
+    datagrok.misc.fstree.FSTree. The root becomes a <tree> element and every
+    other node a <node> element nested within its parent, with the path
+    component in its 'name' attribute. Values other than None are converted
+    to strings and stored in a 'value' attribute.
+
+    Elements are written as the tree is walked, so memory use does not
+    grow with the size of the tree.
+
+        >>> from StringIO import StringIO
+        >>> from datagrok.misc.tree import Tree
+        >>> T = Tree.bulk_load([('a/b', 'one'), ('a/c', 2), ('d', '<&>')])
+        >>> out = StringIO()
+        >>> dump_tree(T, out)
+        >>> print out.getvalue()
+        <?xml version="1.0" encoding="utf-8"?>
+        <tree><node name="a"><node name="c" value="2"></node><node name="b" value="one"></node></node><node name="d" value="&lt;&amp;&gt;"></node></tree>
+        >>> T2 = load_tree(StringIO(out.getvalue()))
+        >>> T2['a/b'], T2['a/c'], T2['d'], T2['a']
+        ('one', '2', '<&>', None)
+
+    """
+    from datagrok.misc.tree import HierarchicalMapping
+    gen = XMLGenerator(out, encoding)
+    gen.startDocument()
+    if isinstance(tree, HierarchicalMapping):
+        events = _hierarchical_mapping_events(tree)
+    else:
+        events = _fstree_events(tree)
+    for name, value in events:
+        if name is None:
+            gen.endElement('node')
+            continue
+        attrs = {}
+        if name is not _ROOT:
+            attrs['name'] = str(name)
+        if value is not None:
+            attrs['value'] = value if isinstance(value, basestring) else str(value)
+        gen.startElement('tree' if name is _ROOT else 'node', attrs)
+    gen.endElement('tree')
+    gen.endDocument()
+
+
+# Marks the root in the event streams below.
+_ROOT = object()
+
+
+def _hierarchical_mapping_events(tree):
+    """Generate (name, value) for each node of a HierarchicalMapping
+    opening an element, and (None, None) for each closing one, leaving the
+    root open.
+
+    """
+    depth = 0
+    for node, path in tree.walk(depth=True):
+        while path and depth >= len(path):
+            yield None, None
+            depth -= 1
+        yield (path[-1] if path else _ROOT), node.value
+        depth = len(path)
+    while depth > 0:
+        yield None, None
+        depth -= 1
+
+
+def _fstree_events(tree):
+    """As _hierarchical_mapping_events(), for an FSTree. An empty FSTree
+    has no root entry; its root is given the value None.
+
+    """
+    yield _ROOT, (tree[''] if '' in tree else None)
+    stack = [iter(tree.children(''))]
+    while stack:
+        for path in stack[-1]:
+            yield path.rpartition('/')[2], tree[path]
+            stack.append(iter(tree.children(path)))
+            break
+        else:
+            stack.pop()
+            if stack:
+                yield None, None
+
+
+def load_tree(source, tree=None):
+    """Read XML written by dump_tree() from a filename or file object into
+    'tree', a new datagrok.misc.tree.Tree by default, and return it.
+
+    'tree' may also be a datagrok.misc.fstree.FSTree, whose nodes are set one
+    at a time (or, for an SQLiteFSTree, in one transaction with its load()).
+
+    The document is parsed incrementally and each element is discarded once
+    read, so memory use does not grow with the size of the document.
+
+        >>> from StringIO import StringIO
+        >>> from datagrok.misc.fstree import FSTree
+        >>> out = StringIO()
+        >>> dump_tree(FSTree(), out)
+        >>> print out.getvalue()
+        <?xml version="1.0" encoding="utf-8"?>
+        <tree></tree>
+        >>> F = FSTree()
+        >>> F['a/b'] = 'one'
+        >>> out = StringIO()
+        >>> dump_tree(F, out)
+        >>> F2 = load_tree(StringIO(out.getvalue()), FSTree())
+        >>> sorted(F2.tree.items())
+        [('', None), ('a', None), ('a/b', 'one')]
+
+    """
+    if tree is None:
+        from datagrok.misc.tree import Tree
+        tree = Tree()
+    items = _iter_tree_items(source)
+    if hasattr(tree, 'update_many'):
+        tree.update_many(items)
+    elif hasattr(tree, 'load'):
+        tree.load(('/'.join(path), value) for path, value in items)
+    else:
+        for path, value in items:
+            tree['/'.join(path)] = value
+    return tree
+
+
+def _iter_tree_items(source):
+    """Generate the (path, value) pairs of a dump_tree() document, in
+    document order.
+
+    """
+    path = []
+    elements = []
+    for event, elem in ElementTree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if elements:
+                path.append(elem.get('name'))
+            elements.append(elem)
+            yield path, elem.get('value')
+        else:
+            elements.pop()
+            if elements:
+                path.pop()
+                # The parent's attributes were read when it started, and its
+                # earlier children have ended; drop them all.
+                elements[-1].clear()
+
+
+def _benchmark():
+    """Compare iter_builder() with building and serializing a DOM."""
+    import timeit
+    def feed():
+        return ('urlset', {'xmlns': 'http://www.sitemaps.org/schemas/sitemap/0.9'},
+                [('url', [('loc', ['http://example.com/page%d?a=1&b=2' % i]),
+                          ('priority', ['0.5'])])
+                 for i in xrange(50000)])
+    for name, render in [
+            ('builder().toxml()', lambda: builder(feed()).toxml()),
+            ('iter_builder()', lambda: ''.join(iter_builder(feed()))),
+            ]:
+        start = timeit.default_timer()
+        render()
+        elapsed = timeit.default_timer() - start
+        print '%-20s %.2f sec' % (name, elapsed)
+
+
+if __name__ == "__main__":
+    _benchmark()